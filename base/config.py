@@ -3,9 +3,25 @@ import configparser
 config = configparser.RawConfigParser()
 config.read('config.ini')
 
-owner = config['BOT'].getint('owner')
-accessToken = config['BOT']['accesstoken']
-heartbeatURL = config['BOT'].get('heartbeaturl')
 
-WEBHOOK: dict = config._sections['WEBHOOK']
-WEBHOOK['port'] = int(WEBHOOK['port'])
+def bot_config(section: str) -> dict:
+    """
+    Config of the bot in section [BOT] or [BOT:<name>].
+    Webhook settings are read from [WEBHOOK], overridden by [WEBHOOK:<name>].
+    """
+    name = section.partition(':')[2]
+    webhook: dict = dict(config._sections.get('WEBHOOK', {}))
+    if name:
+        webhook.update(config._sections.get(f'WEBHOOK:{name}', {}))
+    webhook['port'] = int(webhook['port'])
+    return {
+        'name': name,
+        'owner': config[section].getint('owner'),
+        'accessToken': config[section]['accesstoken'],
+        'heartbeatURL': config[section].get('heartbeaturl'),
+        'baseURL': config[section].get('baseurl'),  # Bot API server, for load testing
+        'WEBHOOK': webhook,
+    }
+
+
+BOTS: list[dict] = [bot_config(x) for x in config.sections() if x == 'BOT' or x.startswith('BOT:')]
@@ -1,70 +1,279 @@
+import atexit
+import copy
+import io
 import json
+import os
 import re
+import struct
+import threading
+import time
 import traceback
-from typing import Iterator
+import weakref
+from typing import BinaryIO, Iterator
 
 from base.log import logger
 
 
+class JSONSerializer:
+    """
+    Plain JSON, human readable.
+    """
+    magic = None
+    suffix = '.json'
+
+    def dumps(self, data: object, format=True) -> bytes:
+        """
+        Serialize data.
+        :param format: format json
+        """
+        if format:  # format json
+            return json.dumps(data, ensure_ascii=False, sort_keys=True, indent=4, default=str).encode()
+        return json.dumps(data, default=str).encode()
+
+    def load(self, f: BinaryIO, digit_mode=False) -> object:
+        """
+        Load data from file.
+        :param digit_mode: convert dict keys to int
+        """
+        data = json.load(f)
+        if digit_mode and isinstance(data, dict):
+            data = {int(k): v for k, v in data.items()}
+        return data
+
+
+class RecordSerializer:
+    """
+    Fixed-width binary layout for reminder records, {chat: {'ts', 'dh', 'alert'}}.
+    Each record is packed as (chat, ts, dh, alert), alert 0 means no alert.
+    """
+    magic = b'ISR\x01'
+    suffix = '.bin'
+    layout = struct.Struct('<qqhq')
+    batch = 4096  # records per read
+
+    def dumps(self, data: dict, format=True) -> bytes:
+        """
+        Serialize data. `format` is ignored.
+        """
+        buf = bytearray(self.magic)
+        pack = self.layout.pack
+        for chat, rc in data.items():
+            if not rc.keys() <= {'ts', 'dh', 'alert'}:
+                raise ValueError(f'Unsupported record fields: {chat}, {list(rc)}')
+            buf += pack(int(chat), rc['ts'], rc['dh'], rc.get('alert', 0))
+        return bytes(buf)
+
+    def load(self, f: BinaryIO, digit_mode=True) -> dict:
+        """
+        Load data from file, batch by batch, into an int-keyed dict.
+        """
+        if f.read(len(self.magic)) != self.magic:
+            raise ValueError('Bad magic number')
+        data = {}
+        size = self.layout.size
+        while chunk := f.read(size * self.batch):
+            if len(chunk) % size:
+                raise ValueError('Truncated record')
+            for chat, ts, dh, alert in self.layout.iter_unpack(chunk):
+                data[chat] = {'ts': ts, 'dh': dh, 'alert': alert} if alert else {'ts': ts, 'dh': dh}
+        return data
+
+
+SERIALIZERS = [RecordSerializer]
+
+
+def detect_serializer(f: BinaryIO) -> JSONSerializer | RecordSerializer:
+    """
+    Detect the serializer by the magic number at the head of file, fallback to JSON.
+    """
+    head = f.read(max(len(x.magic) for x in SERIALIZERS))
+    f.seek(0)
+    for serializer in SERIALIZERS:
+        if head.startswith(serializer.magic):
+            return serializer()
+    return JSONSerializer()
+
+
+def loads(content: bytes, digit_mode=False) -> object:
+    """
+    Load data serialized by any serializer, e.g. by `_localStore.dumps`.
+    """
+    f = io.BytesIO(content)
+    return detect_serializer(f).load(f, digit_mode)
+
+
+class _StoreWriter:
+    """
+    Background thread which writes local stores to file.
+    A dump only marks the store dirty; its snapshot is taken by this thread
+    when written, at most once every `interval` seconds per store, so a
+    burst of dumps costs a single copy.
+    """
+
+    def __init__(self, interval: float = 5) -> None:
+        self.cond = threading.Condition()
+        self.interval = interval
+        self.pending: dict = {}  # store -> format
+        self.written = weakref.WeakKeyDictionary()  # store -> time of the last write
+        self.urgent = False  # write pending stores now, set by `flush`
+        self.busy = False
+        self.thread = None
+
+    def submit(self, store: '_localStore', format=True) -> None:
+        """
+        Mark the store dirty.
+        """
+        with self.cond:
+            self.pending[store] = format
+            if self.thread is None:
+                self.thread = threading.Thread(target=self.run, name='StoreWriter', daemon=True)
+                self.thread.start()
+            self.cond.notify_all()
+
+    def __next(self) -> tuple['_localStore', float]:
+        """
+        The pending store written the longest ago, and how long until it may be written again.
+        """
+        store = min(self.pending, key=lambda x: self.written.get(x, float('-inf')))
+        return store, 0 if self.urgent else self.written.get(store, float('-inf')) + self.interval - time.monotonic()
+
+    def run(self) -> None:
+        while True:
+            with self.cond:
+                self.cond.wait_for(lambda: self.pending)
+                store, wait = self.__next()
+                while wait > 0:
+                    self.cond.wait(wait)
+                    store, wait = self.__next()
+                format = self.pending.pop(store)
+                self.busy = True
+            try:
+                # taken here, a shallow copy runs in C without releasing the GIL,
+                # so the event loop never sees a half-copied store
+                store.write(store.snapshot(), format)
+            except Exception as e:  # keep writing other stores
+                logger.error(f'Failed to write snapshot. {store.filepath}, {e}')
+                logger.debug(traceback.format_exc())
+            finally:
+                with self.cond:
+                    self.written[store] = time.monotonic()
+                    self.busy = False
+                    self.urgent = self.urgent and bool(self.pending)
+                    self.cond.notify_all()
+
+    def flush(self, timeout: float = None) -> bool:
+        """
+        Write all pending stores now, and wait until written.
+        Return False if timeout.
+        """
+        with self.cond:
+            self.urgent = bool(self.pending)
+            self.cond.notify_all()
+            if self.cond.wait_for(lambda: not self.pending and not self.busy, timeout):
+                return True
+        logger.error(f'Timeout when flushing snapshots, {len(self.pending)} pending.')
+        return False
+
+
+writer = _StoreWriter()
+FLUSH_TIMEOUT = 10  # seconds to wait for pending snapshots on shutdown, within kill_timeout of pm2
+atexit.register(writer.flush, FLUSH_TIMEOUT)
+
+
 class _localStore:
     """
     A local file store.
     """
+    digit_mode = False
 
-    def __init__(self, filepath: str, default: int | str | dict | list) -> None:
+    def __init__(self, filepath: str, default: int | str | dict | list, serializer=None, threaded=False,
+                 data: int | str | dict | list = None) -> None:
+        """
+        :param threaded: dump in the background writer thread, coalesced.
+            Only a shallow copy is taken as snapshot, so values must be
+            replaced instead of being updated in place.
+        :param data: initial data, e.g. handed off by another process, instead of loading from file
+        """
         self.filepath = filepath
         self.default = default
-        self.load()
+        self.serializer = serializer or JSONSerializer()
+        self.threaded = threaded
+        if data is None:
+            self.load()
+        else:
+            self.data = data
+
+    def __read(self, filepath: str) -> object:
+        with open(filepath, 'rb') as f:
+            return detect_serializer(f).load(f, self.digit_mode)
+
+    def __write(self, content: bytes) -> None:
+        tmppath = self.filepath + '.tmp'
+        with open(tmppath, 'wb') as f:
+            f.write(content)
+        os.replace(tmppath, self.filepath)
 
     def load(self) -> None:
         """
         Load data from file.
+        Existing files in other formats are detected and loaded as well.
         """
+        legacy = os.path.splitext(self.filepath)[0] + '.json'
         try:
-            with open(self.filepath, 'r') as f:
-                self.data = json.load(f)
+            if not os.path.exists(self.filepath) and os.path.exists(legacy):
+                logger.info(f'Load data from legacy file. {legacy}')
+                self.data = self.__read(legacy)
+                self.dump()
+            else:
+                self.data = self.__read(self.filepath)
         except Exception as e:
             logger.warning(f'Failed to load data, use default. {self.filepath}, {e}')
             logger.debug(traceback.format_exc())
             self.data = self.default
-            with open(self.filepath, 'w') as f:
-                json.dump(self.data, f)
+            self.__write(self.serializer.dumps(self.data, format=False))
 
-    def __dump_check(self, format=True) -> bool:
+    def dump(self, format=True) -> None:
         """
-        Check if the data can be dumped.
+        Dump data to file.
+        In threaded mode, the writer thread writes a snapshot later instead.
         :param format: format json
-        :return: True if the data can be dumped, False otherwise
         """
-        try:
-            if format:  # format json
-                json.dumps(self.data,
-                           ensure_ascii=False, sort_keys=True, indent=4, default=str)
-            else:
-                json.dumps(self.data, default=str)
-            return True
-        except Exception as e:
-            logger.warning(f'Failed to dump data. {self.filepath}, {e}')
-            logger.debug(traceback.format_exc())
-            return False
+        if self.threaded:
+            writer.submit(self, format)
+        else:
+            self.write(self.data, format)
 
-    def dump(self, format=True) -> None:
+    def snapshot(self) -> object:
         """
-        Dump data to file.
+        A shallow copy of data, to be written by the writer thread.
+        """
+        return copy.copy(self.data)
+
+    def write(self, data: object, format=True) -> bool:
+        """
+        Serialize data and write it to file.
         :param format: format json
+        :return: True if written, False otherwise
         """
-        if not self.__dump_check(format):  # check if the data can be dumped
-            return
+        try:  # check if the data can be dumped
+            content = self.serializer.dumps(data, format)
+        except Exception as e:
+            logger.warning(f'Failed to dump data. {self.filepath}, {e}')
+            logger.debug(traceback.format_exc())
+            return False
         try:
-            with open(self.filepath, 'w') as f:
-                if format:
-                    json.dump(self.data, f,
-                              ensure_ascii=False, sort_keys=True, indent=4, default=str)
-                else:
-                    json.dump(self.data, f, default=str)
+            self.__write(content)
+            return True
         except Exception as e:
             logger.error(f'Failed to dump data to file. {self.filepath}, {e}')
             logger.debug(traceback.format_exc())
+            return False
+
+    def dumps(self) -> bytes:
+        """
+        Serialize data in compact form.
+        """
+        return self.serializer.dumps(self.data, format=False)
 
     def update(self, value: int | str | dict | list, update=True) -> None:
         self.data = value
@@ -81,23 +290,66 @@ class _localStore:
         update and self.dump()
 
 
+class _Snapshot:
+    """
+    A point-in-time view of a localDict: the keys at that time, and the
+    previous values of the keys changed since then (copy-on-write).
+    """
+
+    def __init__(self, data: dict) -> None:
+        self.data = data
+        self.keys = list(data)
+        self.before = {}
+
+    def get(self, key: str | int) -> object:
+        return self.before[key] if key in self.before else self.data[key]
+
+
 class localDict(_localStore):
-    def __init__(self, name: str, default: dict = None, folder='data', digit_mode=False) -> None:
+    def __init__(self, name: str, default: dict = None, folder='data', digit_mode=False, serializer=None, threaded=False,
+                 data: dict = None) -> None:
         if default is None:
             default = {}
-        filepath = folder + '/' + name + '.json'
-        super().__init__(filepath, default)
-        if digit_mode:  # convert dict keys to int
-            self.data = {int(k): v for k, v in self.data.items()}
+        if serializer is None:
+            serializer = JSONSerializer()
+        self.digit_mode = digit_mode  # convert dict keys to int
+        self.snapshots: list[_Snapshot] = []
+        filepath = folder + '/' + name + serializer.suffix
+        super().__init__(filepath, default, serializer, threaded, data)
+
+    def _preserve(self, key: str | int) -> None:
+        """
+        Keep the current value of key for open snapshots, before it is changed.
+        """
+        for snapshot in self.snapshots:
+            if snapshot.data is self.data and key in self.data and key not in snapshot.before:
+                snapshot.before[key] = self.data[key]
+
+    def batches(self, size: int = 1000) -> Iterator[list[tuple]]:
+        """
+        Iterate over a consistent snapshot of items, `size` items per batch.
+        Only the keys are copied; values changed during the iteration are
+        preserved on write. Values must be replaced instead of being
+        updated in place.
+        """
+        snapshot = _Snapshot(self.data)
+        self.snapshots.append(snapshot)
+        try:
+            for i in range(0, len(snapshot.keys), size):
+                yield [(key, snapshot.get(key)) for key in snapshot.keys[i:i + size]]
+        finally:
+            self.snapshots.remove(snapshot)
 
     def __getitem__(self, key: str | int) -> object | None:
         return self.data.get(key, None)
 
     def __setitem__(self, key: str | int, value: object) -> None:
+        self.snapshots and self._preserve(key)
         self.data[key] = value
 
     def __delitem__(self, key: str | int) -> None:
         if key in self.data:
+            self.snapshots and self._preserve(key)
             del self.data[key]
 
     def __contains__(self, key: str | int) -> bool:
@@ -116,14 +368,147 @@ class localDict(_localStore):
         return self.data.items()
 
     def set(self, key: str | int, value: object, update=True) -> None:
+        self.snapshots and self._preserve(key)
         self.data[key] = value
         update and self.dump()
 
     def delete(self, key: str | int, update=True) -> None:
         if key in self.data:
+            self.snapshots and self._preserve(key)
             del self.data[key]
         update and self.dump()
 
+    def clear(self, update=True) -> None:
+        for snapshot in self.snapshots:
+            if snapshot.data is self.data:
+                snapshot.data = dict(self.data)
+        super().clear(update)
+
+
+class localJournalDict(localDict):
+    """
+    A local dict which appends each `set` and `delete` to a journal file,
+    instead of rewriting the whole file. The journal is compacted into the
+    file every `compact` entries.
+    """
+
+    def __init__(self, name: str, default: dict = None, folder='data', digit_mode=False, serializer=None, threaded=False,
+                 data: dict = None, compact=1000) -> None:
+        self.journalpath = folder + '/' + name + '.journal'
+        self.compact = compact
+        self.entries = 0
+        self.generation = 0
+        self.loading = False
+        super().__init__(name, default, folder, digit_mode, serializer, threaded, data)
+
+    def load(self) -> None:
+        """
+        Load data from file, then replay the journal on it.
+        Journals being compacted (.<generation>) are replayed before the current one.
+        """
+        self.loading = True  # the journal must not be compacted before replayed
+        try:
+            super().load()
+            generations = self.__generations()
+            self.generation = generations[-1][0] if generations else 0
+            for path in [x for _, x in generations] + [self.journalpath]:
+                if os.path.exists(path):
+                    self.__replay(path)
+        finally:
+            self.loading = False
+
+    def __generations(self) -> list[tuple[int, str]]:
+        """
+        Journals set aside by `dump`, oldest first.
+        """
+        folder, name = os.path.split(self.journalpath)
+        generations = []
+        for x in os.listdir(folder or '.'):
+            match = re.fullmatch(re.escape(name) + r'\.(\d+)', x)
+            if match is not None:
+                generations.append((int(match[1]), os.path.join(folder, x)))
+        return sorted(generations)
+
+    def __replay(self, path: str) -> None:
+        with open(path, 'r') as f:
+            for line in f:
+                try:
+                    entry = json.loads(line)
+                except Exception as e:  # the last entry may be truncated
+                    logger.warning(f'Failed to replay journal. {path}, {e}')
+                    break
+                key = int(entry[0]) if self.digit_mode else entry[0]
+                if len(entry) == 2:
+                    self.data[key] = entry[1]
+                else:
+                    self.data.pop(key, None)
+                self.entries += 1
+
+    def __append(self, entry: list) -> None:
+        try:
+            with open(self.journalpath, 'a') as f:
+                f.write(json.dumps(entry, ensure_ascii=False, default=str) + '\n')
+        except Exception as e:
+            logger.error(f'Failed to append journal, dump instead. {self.journalpath}, {e}')
+            logger.debug(traceback.format_exc())
+            self.dump()
+            return
+        self.entries += 1
+        if self.entries >= self.compact:
+            self.dump()
+
+    def set(self, key: str | int, value: object, update=True) -> None:
+        self.snapshots and self._preserve(key)
+        self.data[key] = value
+        update and self.__append([key, value])
+
+    def delete(self, key: str | int, update=True) -> None:
+        if key in self.data:
+            self.snapshots and self._preserve(key)
+            del self.data[key]
+        update and self.__append([key])
+
+    def dump(self, format=True) -> None:
+        """
+        Dump data to file, and compact the journal.
+        The journal is set aside as a new generation (.<generation>), removed
+        once a snapshot covering it is written.
+        """
+        if self.loading:
+            return
+        if os.path.exists(self.journalpath):
+            os.replace(self.journalpath, f'{self.journalpath}.{self.generation + 1}')
+            self.generation += 1  # after the journal is set aside, see `snapshot`
+        self.entries = 0
+        if self.threaded:
+            writer.submit(self, format)
+        else:
+            self.write((self.data, self.generation), format)
+
+    def snapshot(self) -> tuple[dict, int]:
+        """
+        A shallow copy of data, with the latest generation it covers.
+        The generation is read first: its entries are already in data.
+        """
+        generation = self.generation
+        return copy.copy(self.data), generation
+
+    def write(self, snapshot: tuple[dict, int], format=True) -> bool:
+        """
+        Write a snapshot of (data, generation), then remove the journals it covers.
+        """
+        data, generation = snapshot
+        if not super().write(data, format):
+            return False
+        for x, path in self.__generations():
+            if x > generation:
+                break
+            try:
+                os.remove(path)
+            except FileNotFoundError:
+                pass
+        return True
+
 
 class localList(_localStore):
     def __init__(self, name: str, default: list = None, folder: str = 'data') -> None:
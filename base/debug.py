@@ -6,6 +6,7 @@ from datetime import datetime
 from typing import Callable
 
 from base.log import logger
+from base.profile import record, timer
 
 
 class IgnoreWarning(Exception):
@@ -34,37 +35,48 @@ def eprint(e: Exception, level: int = logging.WARNING, msg: str = None, stacklev
     exception_str = f'Exception: {exception_desc(e)}'
     logger.log(level, exception_str, stacklevel=stacklevel)
 
-    logger.debug(traceback.format_exc(), stacklevel=stacklevel)
+    if logger.isEnabledFor(logging.DEBUG):  # formatting traceback is expensive
+        logger.debug(traceback.format_exc(), stacklevel=stacklevel)
 
 
 def try_except(level: int = logging.WARNING, msg: str = None, return_value: bool = True, exclude=(IgnoreWarning)) -> Callable:
     """
     Try to execute the function.
     If an exception is raised, log it in debug level and return True/False or Return/None.
+    Calls are recorded by the profiler when it is enabled.
     """
     def decorate(func):
+        name = f'{func.__module__}.{func.__qualname__}'
         if asyncio.iscoroutinefunction(func):
             @functools.wraps(func)
             async def wrap(*args, **kwargs):
+                start = timer()
                 try:
                     ret = await func(*args, **kwargs)
+                    record(name, start, False)
                     return ret if return_value else True
                 except exclude as e:
+                    record(name, start, True)
                     eprint(e, logging.DEBUG, msg, stacklevel=3)
                     return None if return_value else False
                 except Exception as e:
+                    record(name, start, True)
                     eprint(e, level, msg, stacklevel=3)
                     return None if return_value else False
         else:
             @functools.wraps(func)
             def wrap(*args, **kwargs):
+                start = timer()
                 try:
                     ret = func(*args, **kwargs)
+                    record(name, start, False)
                     return ret if return_value else True
                 except exclude as e:
+                    record(name, start, True)
                     eprint(e, logging.DEBUG, msg, stacklevel=3)
                     return None if return_value else False
                 except Exception as e:
+                    record(name, start, True)
                     eprint(e, level, msg, stacklevel=3)
                     return None if return_value else False
         return wrap
@@ -0,0 +1,113 @@
+import asyncio
+import fcntl
+import os
+import struct
+from typing import Awaitable, Callable
+
+from base.debug import eprint
+from base.log import logger
+
+HANDOFF_SOCKET = 'data/handoff.sock'
+DATA_LOCK = 'data/.lock'  # held by the only process writing to data/
+HANDOFF_REQUEST = b'HANDOFF\n'
+HANDOFF_EXIT_CODE = 10  # exit code after handing off, not restarted by pm2
+FRAME_HEADER = struct.Struct('<IQ')  # key length, payload length
+
+
+async def send_state(writer: asyncio.StreamWriter, state: dict[str, bytes]) -> None:
+    """
+    Send state as frames of (key, payload), ended by an empty frame.
+    """
+    for key, payload in state.items():
+        key = key.encode()
+        writer.write(FRAME_HEADER.pack(len(key), len(payload)) + key)
+        writer.write(payload)
+        await writer.drain()
+    writer.write(FRAME_HEADER.pack(0, 0))
+    await writer.drain()
+
+
+async def recv_state(reader: asyncio.StreamReader) -> dict[str, bytes]:
+    state = {}
+    while True:
+        key_len, payload_len = FRAME_HEADER.unpack(await reader.readexactly(FRAME_HEADER.size))
+        if key_len == 0:
+            return state
+        key = (await reader.readexactly(key_len)).decode()
+        state[key] = await reader.readexactly(payload_len)
+
+
+async def serve_handoff(release: Callable[[], Awaitable[dict[str, bytes]]], done: Callable[[bool], None],
+                        path: str = HANDOFF_SOCKET) -> asyncio.AbstractServer:
+    """
+    Listen for a new process asking to take over.
+    `release` stops taking updates, drains and returns the state to hand off,
+    `done` is called with True once the state is sent, or False if failed to.
+    """
+    async def handle(reader: asyncio.StreamReader, writer: asyncio.StreamWriter) -> None:
+        try:
+            if await reader.readline() != HANDOFF_REQUEST:
+                return
+            logger.info('Hand off to the new process.')
+            sent = False
+            try:
+                await send_state(writer, await release())
+                sent = True
+            except Exception as e:
+                eprint(e, msg='Failed to hand off state.')
+            finally:
+                done(sent)
+        finally:
+            writer.close()
+
+    if os.path.exists(path):  # left by a crashed process
+        os.remove(path)
+    return await asyncio.start_unix_server(handle, path)
+
+
+async def take_over(path: str = HANDOFF_SOCKET, timeout: float = 60) -> dict[str, bytes]:
+    """
+    Ask the running process to stop and hand off its state.
+    Return an empty dict if there is no running process or the handoff failed.
+    """
+    if not os.path.exists(path):
+        return {}
+    try:
+        reader, writer = await asyncio.open_unix_connection(path)
+    except OSError:  # stale socket
+        return {}
+    try:
+        writer.write(HANDOFF_REQUEST)
+        await writer.drain()
+        state = await asyncio.wait_for(recv_state(reader), timeout)
+        logger.info(f'Took over from the running process, {sum(len(x) for x in state.values())} bytes of state.')
+        return state
+    except Exception as e:
+        eprint(e, msg='Failed to take over, load state from file.')
+        return {}
+    finally:
+        writer.close()
+
+
+async def lock_data(path: str = DATA_LOCK, interval: float = 0.1) -> int:
+    """
+    Lock data/ before loading from it, waiting for the previous process to
+    hand off or exit, so that only one process writes to the data files.
+    Return the file descriptor, the lock is released once it is closed.
+    """
+    os.makedirs(os.path.dirname(path), exist_ok=True)
+    fd = os.open(path, os.O_RDWR | os.O_CREAT, 0o644)
+    try:
+        waiting = False
+        while True:
+            try:
+                fcntl.flock(fd, fcntl.LOCK_EX | fcntl.LOCK_NB)
+                return fd
+            except BlockingIOError:
+                if not waiting:
+                    logger.info('Wait for the previous process to release data/.')
+                    waiting = True
+                await asyncio.sleep(interval)
+    except BaseException:
+        os.close(fd)
+        raise
@@ -0,0 +1,126 @@
+import os
+import sys
+import threading
+import time
+from collections import Counter
+from datetime import datetime
+
+from base.log import logger
+
+
+class CallStats:
+    """
+    Call count, latency and exception count of a function.
+    """
+
+    def __init__(self) -> None:
+        self.calls = 0
+        self.errors = 0
+        self.total = 0.0
+        self.max = 0.0
+
+    def add(self, elapsed: float, failed: bool) -> None:
+        self.calls += 1
+        self.errors += failed
+        self.total += elapsed
+        self.max = max(self.max, elapsed)
+
+    def __str__(self) -> str:
+        avg = self.total / self.calls * 1000 if self.calls else 0
+        rate = self.errors / self.calls * 100 if self.calls else 0
+        return f'calls {self.calls}, avg {avg:.1f}ms, max {self.max * 1000:.1f}ms, errors {rate:.1f}%'
+
+
+class Profiler:
+    """
+    Opt-in profiler: per-function call stats and stack sampling of one thread.
+    """
+
+    def __init__(self) -> None:
+        self.enabled = False
+        self.stats: dict[str, CallStats] = {}
+        self.samples = Counter()
+        self.interval = 0.01
+        self.thread = None
+        self.stopped = threading.Event()
+
+    def record(self, name: str, elapsed: float, failed: bool) -> None:
+        """
+        Record one call of a wrapped function.
+        """
+        if name not in self.stats:
+            self.stats[name] = CallStats()
+        self.stats[name].add(elapsed, failed)
+
+    def start(self, interval: float = 0.01, thread_id: int = None) -> None:
+        """
+        Enable call stats and start sampling the stack of the given thread, current thread by default.
+        """
+        if self.thread is not None:
+            return
+        self.enabled = True
+        self.interval = interval
+        self.stats.clear()
+        self.samples.clear()
+        self.stopped.clear()
+        self.thread = threading.Thread(
+            target=self.sample, args=(thread_id or threading.get_ident(),), name='Profiler', daemon=True)
+        self.thread.start()
+        logger.info(f'Profiler started, interval {interval}s')
+
+    def stop(self) -> str | None:
+        """
+        Stop sampling and dump the samples in folded format, which flamegraph.pl accepts.
+        Return the file path, or None if not running.
+        """
+        if self.thread is None:
+            return None
+        self.enabled = False
+        self.stopped.set()
+        self.thread.join()
+        self.thread = None
+        now = str(datetime.now()).replace(' ', '_').replace(':', '-')
+        filepath = f'log/profile/{now}.folded'
+        os.makedirs(os.path.dirname(filepath), exist_ok=True)
+        with open(filepath, 'w') as f:
+            for stack, count in self.samples.most_common():
+                f.write(f'{stack} {count}\n')
+        logger.info(f'Profiler stopped, {sum(self.samples.values())} samples dumped to {filepath}')
+        return filepath
+
+    def sample(self, thread_id: int) -> None:
+        while not self.stopped.wait(self.interval):
+            frame = sys._current_frames().get(thread_id)
+            if frame is None:
+                return
+            stack = []
+            while frame is not None:
+                code = frame.f_code
+                stack.append(f'{code.co_name} ({os.path.basename(code.co_filename)}:{code.co_firstlineno})')
+                frame = frame.f_back
+            self.samples[';'.join(reversed(stack))] += 1
+
+    def report(self) -> str:
+        """
+        Call stats of wrapped functions, slowest first.
+        """
+        stats = sorted(self.stats.items(), key=lambda x: x[1].total, reverse=True)
+        return '\n'.join(f'{name}: {s}' for name, s in stats)
+
+
+profiler = Profiler()
+
+
+def timer() -> float:
+    """
+    Start time of a call, or None if the profiler is disabled.
+    """
+    return time.perf_counter() if profiler.enabled else None
+
+
+def record(name: str, start: float | None, failed: bool) -> None:
+    """
+    Record a call started at `timer()`.
+    """
+    if start is not None:
+        profiler.record(name, time.perf_counter() - start, failed)
@@ -0,0 +1,63 @@
+"""
+Benchmark peak RSS while exporting records as CSV, batch by batch from a
+snapshot vs. from a full copy of the store.
+
+Each mode runs in its own process. RSS is sampled during the export and
+reported on top of the RSS after the records are loaded.
+
+Usage: python -m benchmark.export [N]
+"""
+import asyncio
+import gzip
+import os
+import subprocess
+import sys
+import tempfile
+import threading
+import time
+
+from benchmark.store import fake_records
+
+
+def rss() -> int:
+    with open('/proc/self/statm') as f:
+        return int(f.read().split()[1]) * os.sysconf('SC_PAGE_SIZE')
+
+
+def child(n: int, mode: str) -> None:
+    from command.admin import write_csv
+    from command.notify import open_channels
+    from command.ingress import open_records
+
+    with tempfile.TemporaryDirectory() as folder:
+        records = open_records(folder, fake_records(n))
+        channels = open_channels(folder)
+
+        base, peak, done = rss(), [0], threading.Event()
+
+        def sample() -> None:
+            while not done.is_set():
+                peak[0] = max(peak[0], rss())
+                time.sleep(0.005)
+        thread = threading.Thread(target=sample)
+        thread.start()
+        start = time.perf_counter()
+        if mode == 'copy':  # what a safe export needs without snapshots
+            records = open_records(folder, {k: dict(v) for k, v in records.items()})
+        with gzip.open(f'{folder}/records.csv.gz', 'wt', compresslevel=6, newline='') as f:
+            rows = asyncio.run(write_csv(records, channels, f))
+        elapsed = time.perf_counter() - start
+        done.set()
+        thread.join()
+        size = os.path.getsize(f'{folder}/records.csv.gz')
+        print(f'{n:>8} {mode:<8} {rows} rows in {elapsed:5.2f}s, {size / 2**20:6.1f} MiB gzipped, '
+              f'RSS {base / 2**20:7.1f} MiB + peak {(max(peak[0], base) - base) / 2**20:6.1f} MiB')
+
+
+if __name__ == '__main__':
+    if sys.argv[1:2] == ['--child']:
+        child(int(sys.argv[2]), sys.argv[3])
+    else:
+        n = sys.argv[1] if len(sys.argv) > 1 else '1000000'
+        for mode in ('batches', 'copy'):
+            subprocess.run([sys.executable, '-m', 'benchmark.export', '--child', n, mode], check=True)
@@ -0,0 +1,338 @@
+"""
+Load test the bot end to end against a local stand-in of the Telegram Bot API.
+
+The fake Bot API answers getMe, setWebhook, sendMessage, deleteMessage,
+answerCallbackQuery, editMessageText and setMyCommands, with configurable
+latency, 429 (retry_after) and 403 injection. It also accepts ntfy
+notifications, which Apprise publishes as JSON posted to the server root,
+so `/add` and seeded chats can use `ntfy://<host>:<port>/<topic>` channels.
+
+The driver posts synthetic webhook updates (/start, /hacked, HACK callbacks,
+/add) to the bot at a target rate, matches them with the replies received by
+the fake Bot API, and reports updates per second, handler latency
+percentiles, and the duration of reminder ticks with the latency of alerts
+from the hour boundary they are due at.
+
+1. Optionally seed records due for an alert within a minute, right before starting the bot,
+   some of them with ntfy channels on the fake API:
+       python -m benchmark.load seed --records data/records.bin --chats 10000 --channels 0.2
+2. Point the bot to the fake API in config.ini, e.g. `baseurl = http://127.0.0.1:8081/bot`
+   in [BOT], and a plain HTTP webhook without `cert` in [WEBHOOK].
+3. Start the load test, then start the bot:
+       python -m benchmark.load run --webhook http://127.0.0.1:4004/ --rate 200 --duration 120
+"""
+import argparse
+import asyncio
+import json
+import os
+import random
+import sys
+import time
+from collections import defaultdict, deque
+
+from aiohttp import ClientSession, ClientTimeout, web
+
+ALERT_TEXTS = ('hacked any portals', 'lost your sojourner streak')
+SEED_CHAT = 10 ** 9  # seeded chats start from here, driver chats from 1
+
+
+class FakeBotAPI:
+    """
+    Local stand-in of the Telegram Bot API.
+    """
+
+    def __init__(self, latency: float = 0, p429: float = 0, retry_after: int = 1, p403: float = 0) -> None:
+        self.latency = latency
+        self.p429 = p429
+        self.retry_after = retry_after
+        self.p403 = p403
+        self.message_id = 0
+        self.calls = defaultdict(int)
+        self.injected = defaultdict(int)
+        self.notifications = 0
+        self.notified = 0  # messages in notifications, several in a batched one
+        self.notified_at: list[float] = []
+        self.ready = asyncio.Event()
+        self.on_reply = None  # callback(chat_id, callback_query_id)
+        self.alerts: list[tuple[float, int]] = []  # (time, chat)
+
+    def app(self) -> web.Application:
+        app = web.Application()
+        app.router.add_route('*', '/bot{token}/{method}', self.handle)
+        app.router.add_post('/', self.notify)
+        return app
+
+    async def notify(self, request: web.Request) -> web.Response:
+        """
+        Publish to a ntfy topic, in the JSON format.
+        """
+        payload = await request.json()
+        self.notifications += 1
+        self.notified_at.append(time.time())
+        self.notified += sum(payload.get('message', '').lower().count(x) for x in ALERT_TEXTS)
+        return web.json_response({'id': str(self.notifications), 'event': 'message', 'topic': payload.get('topic')})
+
+    async def handle(self, request: web.Request) -> web.Response:
+        method = request.match_info['method'].lower()
+        if request.content_type == 'application/json':
+            params = await request.json()
+        else:
+            params = dict(await request.post())
+        self.calls[method] += 1
+        if self.latency:
+            await asyncio.sleep(random.uniform(self.latency / 2, self.latency * 1.5))
+
+        if method in ('sendmessage', 'deletemessage', 'answercallbackquery', 'editmessagetext'):
+            if random.random() < self.p429:
+                self.injected[429] += 1
+                return web.json_response({
+                    'ok': False, 'error_code': 429,
+                    'description': f'Too Many Requests: retry after {self.retry_after}',
+                    'parameters': {'retry_after': self.retry_after}}, status=429)
+            if random.random() < self.p403:
+                self.injected[403] += 1
+                return web.json_response({
+                    'ok': False, 'error_code': 403,
+                    'description': 'Forbidden: bot was blocked by the user'}, status=403)
+
+        if method == 'getme':
+            result = {'id': 1, 'is_bot': True, 'first_name': 'Fake', 'username': 'fake_bot'}
+        elif method == 'setwebhook':
+            self.ready.set()
+            result = True
+        elif method in ('sendmessage', 'editmessagetext'):
+            chat_id, text = int(params['chat_id']), params.get('text', '')
+            if method == 'sendmessage':
+                self.message_id += 1
+            message_id = int(params.get('message_id', self.message_id))
+            result = {'message_id': message_id, 'date': int(time.time()), 'text': text,
+                      'chat': {'id': chat_id, 'type': 'private'}}
+            if any(x in text.lower() for x in ALERT_TEXTS):
+                self.alerts.append((time.time(), chat_id))
+            elif self.on_reply is not None:
+                self.on_reply(chat_id, None)
+        elif method == 'answercallbackquery':
+            if self.on_reply is not None:
+                self.on_reply(None, params['callback_query_id'])
+            result = True
+        else:  # deleteMessage, setMyCommands and others
+            result = True
+        return web.json_response({'ok': True, 'result': result})
+
+
+class Driver:
+    """
+    Post synthetic webhook updates to the bot and match them with the replies.
+    """
+
+    def __init__(self, api: FakeBotAPI, webhook: str, secret: str, chats: int, notify_url: str) -> None:
+        self.api = api
+        self.webhook = webhook
+        self.secret = secret
+        self.chats = chats
+        self.notify_url = notify_url
+        self.update_id = 0
+        self.posted = 0
+        self.failed = 0
+        self.pending: dict[int, deque] = defaultdict(deque)  # chat -> (send time, callback_query_id)
+        self.callbacks: dict[str, int] = {}  # callback_query_id -> chat
+        self.latencies: list[float] = []
+        api.on_reply = self.on_reply
+
+    def on_reply(self, chat_id: int | None, callback_query_id: str | None) -> None:
+        """
+        Match a reply with the earliest pending update of the chat,
+        or with the update of the callback query.
+        """
+        now = time.perf_counter()
+        if callback_query_id is not None:
+            chat_id = self.callbacks.pop(callback_query_id, None)
+            for item in self.pending.get(chat_id, ()):
+                if item[1] == callback_query_id:
+                    self.pending[chat_id].remove(item)
+                    self.latencies.append(now - item[0])
+                    return
+            return
+        if self.pending.get(chat_id):
+            start, callback_query_id = self.pending[chat_id].popleft()
+            self.callbacks.pop(callback_query_id, None)
+            self.latencies.append(now - start)
+
+    def update(self) -> tuple[dict, int, str | None]:
+        self.update_id += 1
+        chat = random.randint(1, self.chats)
+        user = {'id': chat, 'is_bot': False, 'first_name': f'user{chat}'}
+        message = {'message_id': self.update_id, 'date': int(time.time()), 'from': user,
+                   'chat': {'id': chat, 'type': 'private', 'first_name': f'user{chat}'}}
+        kind = random.choices(['start', 'hacked', 'HACK', 'add'], weights=[2, 3, 4, 1])[0]
+        if kind == 'HACK':
+            callback_id = str(self.update_id)
+            return {'update_id': self.update_id, 'callback_query': {
+                'id': callback_id, 'from': user, 'chat_instance': str(chat),
+                'data': 'HACK', 'message': dict(message, text='Welcome')}}, chat, callback_id
+        text = f'/{kind}' + (f' {self.notify_url}' if kind == 'add' else '')
+        message.update(text=text, entities=[{'type': 'bot_command', 'offset': 0, 'length': len(kind) + 1}])
+        return {'update_id': self.update_id, 'message': message}, chat, None
+
+    async def post(self, session: ClientSession) -> None:
+        update, chat, callback_id = self.update()
+        self.pending[chat].append((time.perf_counter(), callback_id))
+        if callback_id is not None:
+            self.callbacks[callback_id] = chat
+        headers = {'X-Telegram-Bot-Api-Secret-Token': self.secret} if self.secret else {}
+        try:
+            async with session.post(self.webhook, data=json.dumps(update), headers=headers,
+                                    timeout=ClientTimeout(total=10)) as r:
+                await r.read()
+            if r.status == 200:
+                self.posted += 1
+            else:
+                self.failed += 1
+        except Exception:
+            self.failed += 1
+
+    async def run(self, rate: float, duration: float) -> float:
+        """
+        Post updates at `rate` per second for `duration` seconds, return the elapsed time.
+        """
+        tasks = set()
+        async with ClientSession(headers={'Content-Type': 'application/json'}) as session:
+            start = time.perf_counter()
+            deadline = start + duration
+            next_time = start
+            while next_time < deadline:
+                task = asyncio.create_task(self.post(session))
+                tasks.add(task)
+                task.add_done_callback(tasks.discard)
+                next_time += 1 / rate
+                await asyncio.sleep(max(0, next_time - time.perf_counter()))
+            await asyncio.gather(*tasks)
+            return time.perf_counter() - start
+
+
+def percentile(values: list[float], p: float) -> float:
+    return values[min(len(values) - 1, int(len(values) * p))] if values else float('nan')
+
+
+def ticks(alerts: list[tuple[float, int]], gap: float = 30) -> list[list[tuple[float, int]]]:
+    """
+    Group alerts into reminder ticks.
+    """
+    groups = []
+    for alert in alerts:
+        if groups and alert[0] - groups[-1][-1][0] < gap:
+            groups[-1].append(alert)
+        else:
+            groups.append([alert])
+    return groups
+
+
+def report(api: FakeBotAPI, driver: Driver, elapsed: float, records: dict) -> None:
+    """
+    :param records: seeded records, to measure the latency of their alerts from the hour boundary
+    """
+    latencies = sorted(driver.latencies)
+    unanswered = sum(len(x) for x in driver.pending.values())
+    print(f'updates posted     {driver.posted} in {elapsed:.1f}s, {driver.posted / elapsed:.1f}/s, {driver.failed} failed')
+    print(f'replies matched    {len(latencies)}, {len(latencies) / elapsed:.1f}/s, {unanswered} unanswered')
+    print('handler latency    ' + '  '.join(
+        f'p{int(p * 100)} {percentile(latencies, p) * 1000:.1f}ms' for p in (0.5, 0.9, 0.99)) +
+        f'  max {(latencies[-1] if latencies else float("nan")) * 1000:.1f}ms')
+    print(f'api calls          {dict(api.calls)}')
+    print(f'injected errors    {dict(api.injected)}')
+    if api.notified_at:
+        span = api.notified_at[-1] - api.notified_at[0]
+        print(f'notifications      {api.notifications} deliveries of {api.notified} alerts in {span:.2f}s'
+              + (f', {api.notifications / span:.1f}/s' if span > 0 else ''))
+    for i, tick in enumerate(ticks(api.alerts)):
+        text = f'reminder tick {i}    {len(tick)} alerts in {tick[-1][0] - tick[0][0]:.2f}s'
+        latency = [(t - records[chat]['ts']) % 3600 for t, chat in tick if chat in records]
+        if latency:
+            text += f', latency from the hour boundary avg {sum(latency) / len(latency):.1f}s max {max(latency):.1f}s'
+        print(text)
+
+
+async def run(args: argparse.Namespace) -> None:
+    records = {}
+    if os.path.exists(args.records):  # read before the bot refreshes them
+        from base.data import loads
+        with open(args.records, 'rb') as f:
+            records = loads(f.read(), digit_mode=True)
+    api = FakeBotAPI(args.latency / 1000, args.p429, args.retry_after, args.p403)
+    runner = web.AppRunner(api.app())
+    await runner.setup()
+    await web.TCPSite(runner, args.host, args.port).start()
+    print(f'Fake Bot API listening on http://{args.host}:{args.port}/bot, waiting for the bot to set webhook', file=sys.stderr)
+    try:
+        await api.ready.wait()
+        await asyncio.sleep(args.warmup)
+        driver = Driver(api, args.webhook, args.secret, args.chats,
+                        f'ntfy://{args.host}:{args.port}/loadtest')
+        elapsed = await driver.run(args.rate, args.duration)
+        await asyncio.sleep(args.drain)
+        report(api, driver, elapsed, records)
+    finally:
+        await runner.cleanup()
+
+
+def seed(args: argparse.Namespace) -> None:
+    """
+    Write records which are all due for an alert within a minute,
+    or all just hacked. A share of them get a ntfy channel on the fake API,
+    spread over a few topics.
+    """
+    from base.data import JSONSerializer, RecordSerializer
+
+    now = int(time.time())
+    if args.state == 'due':
+        data = {SEED_CHAT + i: {'ts': now - 24 * 3600 + random.randint(10, 60), 'dh': 23} for i in range(args.chats)}
+    else:
+        data = {SEED_CHAT + i: {'ts': now - 1800, 'dh': 0} for i in range(args.chats)}
+    with open(args.records, 'wb') as f:
+        f.write(RecordSerializer().dumps(data))
+    channels = {chat: [f'ntfy://{args.host}:{args.port}/seed{chat % args.topics}'] for chat in data
+                if random.random() < args.channels}
+    path = os.path.join(os.path.dirname(args.records), 'channels.json')
+    with open(path, 'wb') as f:
+        f.write(JSONSerializer().dumps(channels))
+    print(f'{args.chats} records written to {args.records}, {len(channels)} channels to {path}')
+
+
+def main() -> None:
+    parser = argparse.ArgumentParser(description='Load test the bot against a fake Telegram Bot API.')
+    sub = parser.add_subparsers(dest='command', required=True)
+
+    p = sub.add_parser('run', help='serve the fake Bot API and post webhook updates')
+    p.add_argument('--host', default='127.0.0.1')
+    p.add_argument('--port', type=int, default=8081, help='port of the fake Bot API')
+    p.add_argument('--webhook', default='http://127.0.0.1:4004/', help='webhook URL of the bot')
+    p.add_argument('--secret', default='', help='secret_token of the webhook')
+    p.add_argument('--rate', type=float, default=100, help='updates per second')
+    p.add_argument('--duration', type=float, default=60, help='seconds')
+    p.add_argument('--chats', type=int, default=1000, help='number of distinct chats')
+    p.add_argument('--latency', type=float, default=0, help='mean latency of the fake Bot API in ms')
+    p.add_argument('--p429', type=float, default=0, help='probability of 429 responses')
+    p.add_argument('--retry-after', type=int, default=1, help='retry_after of 429 responses')
+    p.add_argument('--p403', type=float, default=0, help='probability of 403 responses')
+    p.add_argument('--warmup', type=float, default=1, help='seconds to wait after the bot is up')
+    p.add_argument('--drain', type=float, default=5, help='seconds to wait for replies after the run')
+    p.add_argument('--records', default='data/records.bin', help='records seeded by `seed`, if any')
+
+    p = sub.add_parser('seed', help='write records due for an alert')
+    p.add_argument('--records', default='data/records.bin')
+    p.add_argument('--chats', type=int, default=10000)
+    p.add_argument('--state', choices=['due', 'hacked'], default='due')
+    p.add_argument('--channels', type=float, default=0.2, help='share of chats with a ntfy channel')
+    p.add_argument('--topics', type=int, default=10, help='ntfy topics shared by those chats')
+    p.add_argument('--host', default='127.0.0.1', help='host of the fake Bot API')
+    p.add_argument('--port', type=int, default=8081, help='port of the fake Bot API')
+
+    args = parser.parse_args()
+    if args.command == 'run':
+        asyncio.run(run(args))
+    else:
+        seed(args)
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,55 @@
+"""
+Benchmark event loop lag while dumping a large store, inline vs. in the writer thread.
+
+Usage: python -m benchmark.loop_lag [N]
+"""
+import asyncio
+import sys
+import tempfile
+import time
+
+from base.data import RecordSerializer, localDict, writer
+from benchmark.store import fake_records
+
+TICK = 0.001  # expected wakeup interval of the probe
+DUMPS = 5
+
+
+async def probe(lags: list, stop: asyncio.Event) -> None:
+    while not stop.is_set():
+        start = time.perf_counter()
+        await asyncio.sleep(TICK)
+        lags.append(time.perf_counter() - start - TICK)
+
+
+async def run(store: localDict) -> tuple[list, float]:
+    lags, stop = [], asyncio.Event()
+    task = asyncio.create_task(probe(lags, stop))
+    await asyncio.sleep(0.1)
+    start = time.perf_counter()
+    for _ in range(DUMPS):
+        store.dump()
+        await asyncio.sleep(0.05)
+    await asyncio.to_thread(writer.flush)
+    elapsed = time.perf_counter() - start
+    stop.set()
+    await task
+    return lags, elapsed
+
+
+def bench(n: int) -> None:
+    data = fake_records(n)
+    with tempfile.TemporaryDirectory() as folder:
+        for threaded in (False, True):
+            store = localDict('records', folder=folder, digit_mode=True,
+                              serializer=RecordSerializer(), threaded=threaded)
+            store.update(data, update=False)
+            lags, elapsed = asyncio.run(run(store))
+            lags.sort()
+            print(f'{n:>8} {"threaded" if threaded else "inline":<8} {DUMPS} dumps in {elapsed:6.2f}s  '
+                  f'lag p50 {lags[len(lags) // 2] * 1000:7.2f}ms  '
+                  f'p99 {lags[len(lags) * 99 // 100] * 1000:7.2f}ms  max {lags[-1] * 1000:7.2f}ms')
+
+
+if __name__ == '__main__':
+    bench(int(sys.argv[1]) if len(sys.argv) > 1 else 500000)
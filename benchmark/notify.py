@@ -0,0 +1,45 @@
+"""
+Benchmark outbound notification calls per reminder tick with overlapping channels.
+
+Each alerting chat has up to three channels, drawn from a pool of shared
+endpoints (group bots, ntfy topics, a shared bark device) and private ones.
+Only group bots and topics batch, others get one delivery per chat.
+
+Usage: python -m benchmark.notify [CHATS] [SHARED]
+"""
+import random
+import sys
+import tempfile
+
+from command.notify import NotifyBatch, open_channels
+
+SHARED = ['ntfy://ntfy.sh/ingress-{}', 'wecombot://key{}', 'feishu://token{}', 'bark://api.day.app/shared{}']
+PRIVATE = ['bark://api.day.app/device{}', 'wxpusher://AT_token/UID_{}']
+
+
+def bench(chats: int, shared: int) -> None:
+    with tempfile.TemporaryDirectory() as folder:
+        channels = open_channels(folder)
+        for chat in range(chats):
+            urls = {random.choice(SHARED).format(random.randrange(shared)) for _ in range(random.randint(0, 2))}
+            if random.random() < 0.5:
+                urls.add(random.choice(PRIVATE).format(chat))
+            for url in urls:
+                channels.add(chat, url)
+
+        batch = NotifyBatch(channels)
+        before = 0
+        for chat in range(chats):
+            hours = random.choice([24, 26, 28, 30, 31, 32])  # a tick alerts chats at different hours
+            body = f'You have not hacked any portals in Ingress for {hours} hours, please hack immediately!'
+            before += len(channels[chat])  # one call per channel of each chat
+            batch.add(chat, 'Ingress Sojourner Reminder', body)
+        after = len(batch.plan())
+        print(f'{chats:>7} chats, {shared:>4} shared endpoints: '
+              f'{before} calls per chat, {after} calls batched ({after / max(before, 1) * 100:.1f}%)')
+
+
+if __name__ == '__main__':
+    chats = int(sys.argv[1]) if len(sys.argv) > 1 else 10000
+    for shared in map(int, sys.argv[2:] or [10, 100, 1000]):
+        bench(chats, shared)
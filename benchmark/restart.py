@@ -0,0 +1,124 @@
+"""
+Measure how long the webhook is unavailable during a hot restart.
+
+A bot is started in a temporary folder against the fake Bot API of
+benchmark.load, then a second one is started and takes over. The webhook
+is probed every few milliseconds during the handoff.
+
+Usage: python -m benchmark.restart [--records N] [--cold]
+"""
+import argparse
+import asyncio
+import json
+import os
+import signal
+import subprocess
+import sys
+import tempfile
+import time
+
+from aiohttp import ClientSession, ClientTimeout, web
+
+from benchmark.load import FakeBotAPI
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+CONFIG = '''[BOT]
+accesstoken = 1:fake
+baseurl = http://127.0.0.1:{api}/bot
+
+[WEBHOOK]
+listen = 127.0.0.1
+port = {port}
+webhook_url = http://127.0.0.1:{port}/
+'''
+UPDATE = {'update_id': 1, 'message': {
+    'message_id': 1, 'date': 0, 'text': '/list', 'entities': [{'type': 'bot_command', 'offset': 0, 'length': 5}],
+    'chat': {'id': 1, 'type': 'private'}, 'from': {'id': 1, 'is_bot': False, 'first_name': 'probe'}}}
+
+
+def spawn(folder: str) -> subprocess.Popen:
+    return subprocess.Popen([sys.executable, os.path.join(ROOT, 'bot.py')], cwd=folder,
+                            env=dict(os.environ, PYTHONPATH=ROOT), stdout=subprocess.DEVNULL)
+
+
+async def probe(url: str, results: list, stop: asyncio.Event, interval: float) -> None:
+    async with ClientSession() as session:
+        while not stop.is_set():
+            start = time.perf_counter()
+            try:
+                async with session.post(url, data=json.dumps(UPDATE), timeout=ClientTimeout(total=1),
+                                        headers={'Content-Type': 'application/json'}) as r:
+                    ok = r.status == 200
+            except Exception:
+                ok = False
+            results.append((start, ok))
+            await asyncio.sleep(interval)
+
+
+def longest_outage(results: list) -> float:
+    longest, down = 0.0, None
+    for t, ok in results:
+        if not ok and down is None:
+            down = t
+        elif ok and down is not None:
+            longest, down = max(longest, t - down), None
+    return longest
+
+
+async def run(args: argparse.Namespace) -> None:
+    api = FakeBotAPI()
+    runner = web.AppRunner(api.app())
+    await runner.setup()
+    await web.TCPSite(runner, '127.0.0.1', args.api).start()
+
+    with tempfile.TemporaryDirectory() as folder:
+        os.makedirs(f'{folder}/log')
+        os.makedirs(f'{folder}/data')
+        with open(f'{folder}/config.ini', 'w') as f:
+            f.write(CONFIG.format(api=args.api, port=args.port))
+        if args.records:
+            subprocess.run([sys.executable, '-m', 'benchmark.load', 'seed', '--chats', str(args.records), '--state', 'hacked'],
+                           cwd=folder, env=dict(os.environ, PYTHONPATH=ROOT), check=True)
+
+        old = spawn(folder)
+        await asyncio.wait_for(api.ready.wait(), 60)
+        await asyncio.sleep(1)
+
+        results, stop = [], asyncio.Event()
+        task = asyncio.create_task(probe(f'http://127.0.0.1:{args.port}/', results, stop, args.interval / 1000))
+        await asyncio.sleep(0.5)
+        api.ready.clear()
+        start = time.perf_counter()
+        if args.cold:  # stop the old process first, as pm2 restart does
+            old.send_signal(signal.SIGTERM)
+            await asyncio.to_thread(old.wait, 60)
+        new = spawn(folder)
+        await asyncio.wait_for(api.ready.wait(), 60)
+        await asyncio.to_thread(old.wait, 60)
+        restart = time.perf_counter() - start
+        await asyncio.sleep(0.5)
+        stop.set()
+        await task
+
+        new.send_signal(signal.SIGTERM)
+        await asyncio.to_thread(new.wait, 60)
+
+    await runner.cleanup()
+    failed = sum(not ok for _, ok in results)
+    print(f'{"cold" if args.cold else "hot"} restart with {args.records} records in {restart:.2f}s, '
+          f'old process exit code {old.returncode}')
+    print(f'probes {len(results)}, failed {failed}, webhook unavailable for {longest_outage(results) * 1000:.0f}ms')
+
+
+def main() -> None:
+    parser = argparse.ArgumentParser(description='Measure webhook downtime during a hot restart.')
+    parser.add_argument('--api', type=int, default=8082, help='port of the fake Bot API')
+    parser.add_argument('--port', type=int, default=4010, help='webhook port of the bot')
+    parser.add_argument('--records', type=int, default=0, help='number of records to hand off')
+    parser.add_argument('--interval', type=float, default=5, help='probe interval in ms')
+    parser.add_argument('--cold', action='store_true', help='stop the old process before starting the new one')
+    asyncio.run(run(parser.parse_args()))
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,49 @@
+"""
+Benchmark file size, dump time and load time of local store serializers.
+
+Usage: python -m benchmark.store [N ...]
+"""
+import os
+import random
+import sys
+import tempfile
+import time
+
+from base.data import JSONSerializer, RecordSerializer, localDict
+
+
+def fake_records(n: int) -> dict:
+    now = int(time.time())
+    data = {}
+    for i in range(n):
+        rc = {'ts': now - random.randint(0, 36 * 3600), 'dh': random.randint(-1, 35)}
+        if random.random() < 0.3:
+            rc['alert'] = random.randint(1, 2 ** 31)
+        data[-1000000000000 - i if i % 2 else 100000000 + i] = rc
+    return data
+
+
+def bench(n: int) -> None:
+    data = fake_records(n)
+    with tempfile.TemporaryDirectory() as folder:
+        for serializer in (JSONSerializer(), RecordSerializer()):
+            store = localDict('records', folder=folder, digit_mode=True, serializer=serializer)
+            store.update(data, update=False)
+
+            start = time.perf_counter()
+            store.dump()
+            dump_time = time.perf_counter() - start
+            size = os.path.getsize(store.filepath)
+
+            start = time.perf_counter()
+            store.load()
+            load_time = time.perf_counter() - start
+            assert store.data == data
+
+            print(f'{n:>9} {serializer.__class__.__name__:<16} '
+                  f'size {size / 2**20:8.2f} MiB  dump {dump_time:7.3f}s  load {load_time:7.3f}s')
+
+
+if __name__ == '__main__':
+    for n in map(int, sys.argv[1:] or [100000, 1000000]):
+        bench(n)
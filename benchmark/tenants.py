@@ -0,0 +1,79 @@
+"""
+Benchmark RSS and CPU time of N bots in one process vs. N processes.
+
+Each process imports the bot and builds its applications with fake tokens,
+then idles for a while. No request is sent to Telegram.
+
+Usage: python -m benchmark.tenants [N ...]
+"""
+import os
+import resource
+import subprocess
+import sys
+import tempfile
+import time
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+IDLE = 3  # seconds
+
+
+def child(n: int) -> None:
+    import asyncio
+
+    from telegram.request import HTTPXRequest
+
+    from bot import build_app
+    from command.ingress import ReminderScheduler
+
+    request, updates_request = HTTPXRequest(connection_pool_size=256), HTTPXRequest()
+    cfgs = [{'name': f'bot{i}', 'owner': None, 'accessToken': f'{i + 1}:fake', 'heartbeatURL': None, 'baseURL': None,
+             'WEBHOOK': {}}
+            for i in range(n)]
+    apps = [build_app(cfg, request, updates_request, job_queue=(i == 0)) for i, cfg in enumerate(cfgs)]
+    scheduler = ReminderScheduler(apps[0].job_queue, apps)
+    for app in apps:
+        app.bot_data['scheduler'] = scheduler
+
+    async def run() -> None:
+        for app in apps:
+            await app.post_init(app)
+        await asyncio.sleep(IDLE)
+    asyncio.run(run())
+    usage = resource.getrusage(resource.RUSAGE_SELF)
+    print(len(apps), usage.ru_maxrss, usage.ru_utime + usage.ru_stime)
+
+
+def spawn(n: int, folder: str) -> subprocess.Popen:
+    env = dict(os.environ, PYTHONPATH=ROOT)
+    return subprocess.Popen([sys.executable, '-m', 'benchmark.tenants', '--child', str(n)],
+                            cwd=folder, env=env, stdout=subprocess.PIPE, text=True)
+
+
+def collect(procs: list[subprocess.Popen]) -> tuple[int, float]:
+    rss, cpu = 0, 0.0
+    for p in procs:
+        _, r, c = p.communicate()[0].split()
+        rss, cpu = rss + int(r), cpu + float(c)
+    return rss, cpu
+
+
+def bench(n: int) -> None:
+    with tempfile.TemporaryDirectory() as folder:
+        for i in range(n):
+            os.makedirs(f'{folder}/{i}/log')
+
+        start = time.perf_counter()
+        rss, cpu = collect([spawn(n, f'{folder}/0')])
+        print(f'{n:>3} bots, 1 process:   RSS {rss / 1024:8.1f} MiB  CPU {cpu:6.2f}s  wall {time.perf_counter() - start:5.2f}s')
+
+        start = time.perf_counter()
+        rss, cpu = collect([spawn(1, f'{folder}/{i}') for i in range(n)])
+        print(f'{n:>3} bots, {n} processes: RSS {rss / 1024:8.1f} MiB  CPU {cpu:6.2f}s  wall {time.perf_counter() - start:5.2f}s')
+
+
+if __name__ == '__main__':
+    if sys.argv[1:2] == ['--child']:
+        child(int(sys.argv[2]))
+    else:
+        for n in map(int, sys.argv[1:] or [1, 4, 16]):
+            bench(n)
@@ -0,0 +1,172 @@
+"""
+Compare the fixed 60s reminder tick with the adaptive ReminderScheduler
+over one simulated day: wakeups, CPU time spent in ticks, and the latency
+from an hour boundary to its alert.
+
+Time is virtual, the real `remind` runs against a fake bot. Each chat
+hacks once a day at a random time, as /hacked does, or with --every,
+regularly every few hours, so that it is rarely due.
+
+Usage: python -m benchmark.ticks [--every HOURS] [CHATS ...]
+"""
+import argparse
+import asyncio
+import logging
+import random
+import statistics
+import tempfile
+import time
+from types import SimpleNamespace
+
+import command.ingress
+from base.data import localDict, writer
+from base.log import logger
+from command.ingress import Deadlines, ReminderScheduler, open_records, remind
+from command.notify import open_channels
+
+DAY = 24 * 3600
+INTERVAL = 60  # the fixed tick
+HACKS_PER_DAY = 1
+
+
+class Clock:
+    def __init__(self, now: float) -> None:
+        self.now = now
+
+    def time(self) -> float:
+        return self.now
+
+
+class FakeBot:
+    """
+    Record the latency from the hour boundary of each alert.
+    """
+
+    def __init__(self, clock: Clock, records: localDict) -> None:
+        self.clock = clock
+        self.records = records
+        self.latency = []
+
+    async def send_message(self, chat_id: int, *args, **kwargs) -> SimpleNamespace:
+        ts = self.records[chat_id]['ts']
+        self.latency.append((self.clock.now - ts) % 3600)
+        return SimpleNamespace(message_id=1)
+
+    async def delete_message(self, *args, **kwargs) -> None:
+        pass
+
+
+class FakeJobQueue:
+    """
+    Just enough of JobQueue for ReminderScheduler, run by `simulate`.
+    """
+
+    def __init__(self, clock: Clock) -> None:
+        self.clock = clock
+        self.job = None
+
+    def run_once(self, callback, when: float, job_kwargs: dict = None) -> SimpleNamespace:
+        self.job = SimpleNamespace(when=self.clock.now + when, callback=callback)
+        self.job.schedule_removal = lambda: None
+        return self.job
+
+
+def seed(n: int, now: int, every: float = None) -> dict:
+    data = {}
+    for chat in range(n):
+        ts = now - random.randint(0, int((every - 1 if every else 30) * 3600))  # next regular hack is ahead
+        data[chat] = {'ts': ts, 'dh': (now - ts) // 3600}
+    return data
+
+
+def hacks(n: int, now: int, data: dict, every: float = None) -> list[tuple[int, int]]:
+    """
+    Hacks of a day, at random times, or every `every` hours, give or take an hour.
+    """
+    if every is None:
+        return sorted((now + random.randrange(DAY), chat) for chat in range(n) for _ in range(HACKS_PER_DAY))
+    events = []
+    for chat in range(n):
+        t = data[chat]['ts']
+        while True:
+            t += int((every + random.uniform(-1, 1)) * 3600)
+            if t >= now + DAY:
+                break
+            if t > now:
+                events.append((t, chat))
+    return sorted(events)
+
+
+def hack(records: localDict, deadlines: Deadlines | None, chat: int, now: int) -> None:
+    if chat not in records:  # lost the streak, /start again
+        rc = {'ts': now, 'dh': -1}
+    else:
+        rc = {'ts': now - 1800, 'dh': 0}
+    records.set(chat, rc, update=False)
+    if deadlines is not None:
+        deadlines.push(chat, rc)
+
+
+async def simulate(n: int, adaptive: bool, folder: str, data: dict, events: list, start: int) -> tuple:
+    clock = Clock(start)
+    command.ingress.time = clock  # `remind` and the scheduler read the virtual clock
+    records = open_records(folder, dict(data))
+    channels = open_channels(folder)
+    bot = FakeBot(clock, records)
+    wakeups, cpu = 0, time.process_time()  # of all threads, dumps by the writer included
+
+    async def run(coro) -> None:
+        nonlocal wakeups
+        wakeups += 1
+        await coro
+
+    if not adaptive:
+        events = iter(events)
+        event = next(events, None)
+        for now in range(start + 1, start + DAY, INTERVAL):
+            while event is not None and event[0] <= now:
+                clock.now = event[0]
+                hack(records, None, event[1], event[0])
+                event = next(events, None)
+            clock.now = now
+            await run(remind(bot, records, channels))
+        writer.flush()
+        return wakeups, time.process_time() - cpu, bot.latency
+
+    job_queue = FakeJobQueue(clock)
+    app = SimpleNamespace(bot=bot, bot_data={'records': records, 'channels': channels})
+    scheduler = ReminderScheduler(job_queue, [app])
+    app.bot_data['deadlines'] = Deadlines(records, on_push=scheduler.plan)
+    scheduler.schedule(start + 1)
+    for t, chat in events + [(start + DAY, None)]:
+        while job_queue.job is not None and job_queue.job.when <= t:
+            clock.now = job_queue.job.when
+            await run(job_queue.job.callback(None))
+        if chat is not None:
+            clock.now = t
+            hack(records, app.bot_data['deadlines'], chat, t)
+    writer.flush()
+    return wakeups, time.process_time() - cpu, bot.latency
+
+
+def bench(n: int, every: float = None) -> None:
+    start = int(time.time())
+    data = seed(n, start, every)
+    events = hacks(n, start, data, every)
+    for adaptive in (False, True):
+        with tempfile.TemporaryDirectory() as folder:
+            wakeups, cpu, latency = asyncio.run(simulate(n, adaptive, folder, data, events, start))
+        name = 'adaptive' if adaptive else f'fixed {INTERVAL}s'
+        print(f'{n:>7} chats, {name:>9}: {wakeups:>5} wakeups/day, CPU {cpu:.2f}s/day, '
+              f'{len(latency)} alerts, latency avg {statistics.mean(latency or [0]):.1f}s '
+              f'max {max(latency or [0]):.0f}s')
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser()
+    parser.add_argument('--every', type=float, help='hours between hacks of each chat')
+    parser.add_argument('chats', type=int, nargs='*', default=[1000, 10000, 100000])
+    args = parser.parse_args()
+    logger.setLevel(logging.WARNING)  # one line per alert otherwise
+    for n in args.chats:
+        bench(n, args.every)
@@ -1,17 +1,28 @@
+import asyncio
 import logging
+import os
+import signal
+import sys
+import time
 
 from pytz import timezone
 from telegram import BotCommand, BotCommandScopeAllPrivateChats, Update
 from telegram.ext import (Application, CallbackQueryHandler, CommandHandler,
-                          ContextTypes, JobQueue)
+                          ContextTypes, JobQueue, filters)
+from telegram.request import HTTPXRequest
 
 from base import network
-from base.config import WEBHOOK, accessToken, heartbeatURL
+from base.config import BOTS
+from base.data import FLUSH_TIMEOUT, loads, writer
 from base.debug import try_except
+from base.lifecycle import (HANDOFF_EXIT_CODE, lock_data, serve_handoff,
+                            take_over)
 from base.log import logger
-from command.ingress import (already_hacked, cancel_reminder, records,
-                             reminder, start_reminder)
-from command.notify import channel_add, channel_del, channel_list
+from command.admin import export, profile, stats
+from command.ingress import (Deadlines, ReminderScheduler, already_hacked,
+                             cancel_reminder, open_records, start_reminder)
+from command.notify import (channel_add, channel_del, channel_list,
+                            open_channels)
 
 
 async def error_handler(update: Update, context: ContextTypes.DEFAULT_TYPE) -> None:
@@ -23,43 +34,74 @@ async def error_handler(update: Update, context: ContextTypes.DEFAULT_TYPE) -> N
     logger.debug(update_str)
 
     if update is not None:
-        records.delete(update.effective_chat.id)
+        context.bot_data['records'].delete(update.effective_chat.id)
 
 
 @try_except(level=logging.DEBUG, return_value=False)
 async def heartbeat(context: ContextTypes.DEFAULT_TYPE) -> None:
-    if heartbeatURL is not None:
-        await network.get(heartbeatURL)
-
-
-def main() -> None:
-    """Start the bot."""
-    app: Application = Application.builder().token(accessToken).build()
+    await network.get(context.job.data)
+
+
+async def context_init(context: ContextTypes.DEFAULT_TYPE) -> None:
+    app: Application = context.job.data
+    logger.debug(f"Set bot commands. {app.bot_data['config']['name']}")
+    await app.bot.set_my_commands([
+        BotCommand('hacked', 'Refresh reminder'),
+        BotCommand('start', 'Start reminder'),
+        BotCommand('cancel', 'Cancel reminder'),
+        BotCommand('list', 'List all notification channels'),
+        BotCommand('add', 'Add a notification channel'),
+        BotCommand('del', 'Delete a notification channel')],
+        scope=BotCommandScopeAllPrivateChats())
+
+
+async def post_init(app: Application) -> None:
+    """
+    Open records and channels of the bot, from the state handed off by
+    the previous process if any, otherwise from file.
+    Bots in [BOT:<name>] keep their data in data/<name>/.
+    """
+    cfg = app.bot_data['config']
+    state: dict[str, bytes] = app.bot_data.pop('state', {})
+    folder = f"data/{cfg['name']}" if cfg['name'] else 'data'
+    os.makedirs(folder, exist_ok=True)
+    data = {x: loads(state[f"{cfg['name']}/{x}"], digit_mode=True) if f"{cfg['name']}/{x}" in state else None
+            for x in ('records', 'channels')}
+    app.bot_data['records'] = open_records(folder, data['records'])
+    app.bot_data['channels'] = open_channels(folder, data['channels'])
+    app.bot_data['deadlines'] = Deadlines(app.bot_data['records'], on_push=app.bot_data['scheduler'].plan)
+
+
+async def post_shutdown(app: Application) -> None:
+    """
+    Flush records and channels, unless they have been handed off to the new process.
+    """
+    if 'records' in app.bot_data and not app.bot_data.get('handed_off'):
+        app.bot_data['records'].dump()
+        app.bot_data['channels'].store.dump()
+    await asyncio.to_thread(writer.flush, FLUSH_TIMEOUT)
+
+
+def build_app(cfg: dict, request: HTTPXRequest, updates_request: HTTPXRequest, job_queue=True) -> Application:
+    """
+    Build the application of a bot.
+    Its records and channels are opened in `post_init`.
+    """
+    builder = Application.builder().token(cfg['accessToken']) \
+        .request(request).get_updates_request(updates_request) \
+        .post_init(post_init).post_shutdown(post_shutdown)
+    if cfg['baseURL'] is not None:
+        builder = builder.base_url(cfg['baseURL'])
+    if not job_queue:  # use the job queue of the first bot
+        builder = builder.job_queue(None)
+    app: Application = builder.build()
+    app.bot_data['config'] = cfg
 
     app.add_error_handler(error_handler)
 
-    job: JobQueue = app.job_queue
-    tz = timezone("Asia/Shanghai")  # local_tz
-    jk = {"misfire_grace_time": None}  # job_kwargs
-
-    job.run_repeating(heartbeat, interval=60, first=0, job_kwargs=jk)
-
-    async def context_init(context: ContextTypes.DEFAULT_TYPE) -> None:
-        logger.debug("Set bot commands.")
-        await context.bot.set_my_commands([
-            BotCommand('hacked', 'Refresh reminder'),
-            BotCommand('start', 'Start reminder'),
-            BotCommand('cancel', 'Cancel reminder'),
-            BotCommand('list', 'List all notification channels'),
-            BotCommand('add', 'Add a notification channel'),
-            BotCommand('del', 'Delete a notification channel')],
-            scope=BotCommandScopeAllPrivateChats())
-    job.run_once(context_init, 10)
-
     app.add_handler(CommandHandler('start', start_reminder))
     app.add_handler(CommandHandler('cancel', cancel_reminder))
 
-    job.run_repeating(reminder, interval=60, first=1, job_kwargs=jk)
     # 刷新 Ingress 签到时间间隔（按钮）
     app.add_handler(CallbackQueryHandler(already_hacked, pattern='HACK'))
     # 刷新 Ingress 签到时间间隔（命令）
@@ -71,7 +113,125 @@ def main() -> None:
     app.add_handler(CommandHandler('add', channel_add))
     app.add_handler(CommandHandler('del', channel_del))
 
-    app.run_webhook(**WEBHOOK)
+    # 性能分析、统计与导出（仅限 owner）
+    owner = filters.User(user_id=cfg['owner'])
+    app.add_handler(CommandHandler('profile', profile, filters=owner))
+    app.add_handler(CommandHandler('stats', stats, filters=owner))
+    app.add_handler(CommandHandler('export', export, filters=owner))
+
+    return app
+
+
+async def stop_apps(apps: list[Application]) -> None:
+    """
+    Stop taking webhooks first, then drain pending updates and running jobs.
+    A running reminder tick stops after the chat it is sending to.
+    """
+    if apps:
+        apps[0].bot_data['scheduler'].stop()  # shared by all bots
+    for app in apps:
+        if app.updater.running:
+            await app.updater.stop()
+    for app in apps:
+        if app.running:
+            await app.stop()
+
+
+async def serve(apps: list[Application]) -> bool:
+    """
+    Run all applications in the current event loop until a stop signal is
+    received, or a new process takes over.
+    Return True if the state has been handed off to a new process.
+    data/ is locked from before loading until handed off, or until flushed
+    on shutdown if failed to, so the new process never loads from file while
+    this one may still write to it.
+    """
+    stop = asyncio.Event()
+    loop = asyncio.get_running_loop()
+    for sig in (signal.SIGINT, signal.SIGTERM, signal.SIGABRT):
+        loop.add_signal_handler(sig, stop.set)
+
+    async def release() -> dict[str, bytes]:
+        await stop_apps(running)
+        if not await asyncio.to_thread(writer.flush, FLUSH_TIMEOUT):
+            raise TimeoutError('Data files are still being written.')
+        state = {}
+        for app in running:
+            name = app.bot_data['config']['name']
+            state[f'{name}/records'] = app.bot_data['records'].dumps()
+            state[f'{name}/channels'] = app.bot_data['channels'].store.dumps()
+        return state
+
+    def done(sent: bool) -> None:
+        for app in running:  # otherwise flushed to file on shutdown
+            app.bot_data['handed_off'] = sent
+        handed_off.append(sent)
+        if sent:  # nothing is written from here on
+            unlock()
+        stop.set()
+
+    def unlock() -> None:
+        nonlocal lock
+        if lock is not None:
+            os.close(lock)
+            lock = None
+
+    running: list[Application] = []
+    handed_off: list[bool] = []
+    server = None
+    lock = None
+    try:
+        for app in apps:
+            await app.initialize()
+            running.append(app)
+        # the previous process stops taking webhooks from here on
+        state = await take_over()
+        lock = await lock_data()
+        for app in apps:
+            app.bot_data['state'] = state
+            await app.post_init(app)
+        for app in apps:
+            await app.updater.start_webhook(**app.bot_data['config']['WEBHOOK'])
+            await app.start()
+        server = await serve_handoff(release, done)
+        logger.info('Bot started.')
+        await stop.wait()
+    finally:
+        if server is not None:
+            server.close()
+        await stop_apps(running)
+        for app in running:
+            await app.shutdown()
+            await app.post_shutdown(app)
+        unlock()
+    return any(handed_off)
+
+
+def main() -> None:
+    """Start the bots."""
+    # HTTP connection pool shared by all bots
+    request = HTTPXRequest(connection_pool_size=256)
+    updates_request = HTTPXRequest()
+    apps = [build_app(cfg, request, updates_request, job_queue=(i == 0)) for i, cfg in enumerate(BOTS)]
+
+    # the scheduler of the first bot is shared by all bots
+    job: JobQueue = apps[0].job_queue
+    tz = timezone("Asia/Shanghai")  # local_tz
+    jk = {"misfire_grace_time": None}  # job_kwargs
+
+    for app in apps:
+        if app.bot_data['config']['heartbeatURL'] is not None:
+            job.run_repeating(heartbeat, interval=60, first=0, data=app.bot_data['config']['heartbeatURL'], job_kwargs=jk)
+        job.run_once(context_init, 10, data=app)
+
+    # wake up at the next deadline of any bot, instead of every minute
+    scheduler = ReminderScheduler(job, apps, job_kwargs=jk)
+    for app in apps:
+        app.bot_data['scheduler'] = scheduler
+    scheduler.schedule(time.time() + 1)
+
+    if asyncio.run(serve(apps)):
+        sys.exit(HANDOFF_EXIT_CODE)
 
 
 if __name__ == "__main__":
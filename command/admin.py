@@ -0,0 +1,116 @@
+import asyncio
+import csv
+import gzip
+import os
+import tempfile
+import time
+from collections import Counter
+from typing import TextIO
+
+from telegram import Update
+from telegram.ext import ContextTypes
+
+from base.data import localDict
+from base.log import logger
+from base.profile import profiler
+from command.ingress import ReminderScheduler, hours_since_hack
+from command.notify import ChannelIndex
+
+
+async def profile(update: Update, context: ContextTypes.DEFAULT_TYPE) -> None:
+    """
+    /profile start [interval_ms] | stop | stats
+    """
+    logger.debug(f'chat_id: {update.effective_chat.id}, action: profile, args: {context.args}')
+    action = context.args[0] if context.args else 'stats'
+    if action == 'start':
+        try:
+            interval = int(context.args[1]) / 1000 if len(context.args) > 1 else 0.01
+            assert interval > 0
+        except Exception:
+            await update.effective_message.reply_text('Invalid interval.')
+            return
+        if profiler.thread is not None:
+            await update.effective_message.reply_text('Profiler is already running.')
+            return
+        profiler.start(interval)  # handlers run in the event loop thread
+        await update.effective_message.reply_text(f'Profiler started, interval {interval * 1000:g}ms.')
+    elif action == 'stop':
+        filepath = profiler.stop()
+        if filepath is None:
+            await update.effective_message.reply_text('Profiler is not running.')
+            return
+        await update.effective_message.reply_text(f'Profiler stopped, samples dumped to {filepath}.\n\n'
+                                                  f'{profiler.report() or "No calls recorded."}')
+    elif action == 'stats':
+        await update.effective_message.reply_text(profiler.report() or 'No calls recorded.')
+    else:
+        await update.effective_message.reply_text('Usage: /profile start [interval_ms] | stop | stats')
+
+
+async def collect_stats(records: localDict, channels: ChannelIndex, scheduler: ReminderScheduler = None,
+                        size: int = 10000) -> str:
+    """
+    Statistics of records and channels, scanned batch by batch, and of the reminder scheduler.
+    """
+    total, hours, now = 0, Counter(), int(time.time())
+    for batch in records.batches(size):
+        total += len(batch)
+        hours.update(hours_since_hack(rc, now) for _, rc in batch)
+        await asyncio.sleep(0)  # let handlers run between batches
+    chats, urls, protocols = 0, 0, Counter()
+    for batch in channels.store.batches(size):
+        chats += len(batch)
+        for _, chat_urls in batch:
+            urls += len(chat_urls)
+            protocols.update(url.split('://')[0] for url in chat_urls)
+        await asyncio.sleep(0)
+    shared = sum(len(x) > 1 for x in channels.index.values())
+
+    text = f'Records: {total}, active: {total - hours[-1]}, not hacked yet: {hours[-1]}\n'
+    text += 'Hours since hack:\n' + ''.join(f'- {h}: {n}\n' for h, n in sorted(hours.items()) if h >= 0)
+    text += f'Chats with channels: {chats}, channels: {urls}, shared by several chats: {shared}\n'
+    text += 'Protocols:\n' + ''.join(f'- {p}: {n}\n' for p, n in protocols.most_common())
+    if scheduler is not None:
+        text += f'Reminder wakeups: {scheduler.wakeups}, max lateness: {scheduler.lateness:.1f}s\n'
+    return text
+
+
+async def write_csv(records: localDict, channels: ChannelIndex, f: TextIO, size: int = 10000) -> int:
+    """
+    Write records as CSV batch by batch, return the number of rows.
+    """
+    writer = csv.writer(f)
+    writer.writerow(['chat', 'ts', 'dh', 'alert', 'channels'])
+    rows, now = 0, int(time.time())
+    for batch in records.batches(size):
+        writer.writerows((chat, rc['ts'], hours_since_hack(rc, now), rc.get('alert', ''), len(channels[chat]))
+                         for chat, rc in batch)
+        rows += len(batch)
+        await asyncio.sleep(0)  # let handlers run between batches
+    return rows
+
+
+async def stats(update: Update, context: ContextTypes.DEFAULT_TYPE) -> None:
+    logger.debug(f'chat_id: {update.effective_chat.id}, action: stats')
+    text = await collect_stats(context.bot_data['records'], context.bot_data['channels'],
+                               context.bot_data['scheduler'])
+    await update.effective_message.reply_text(text)
+
+
+async def export(update: Update, context: ContextTypes.DEFAULT_TYPE) -> None:
+    """
+    Export records as a gzipped CSV document.
+    The file is written to disk batch by batch, only the compressed file is uploaded.
+    """
+    logger.debug(f'chat_id: {update.effective_chat.id}, action: export')
+    fd, filepath = tempfile.mkstemp(suffix='.csv.gz')
+    os.close(fd)
+    try:
+        with gzip.open(filepath, 'wt', compresslevel=6, newline='') as f:
+            rows = await write_csv(context.bot_data['records'], context.bot_data['channels'], f)
+        with open(filepath, 'rb') as f:
+            await update.effective_message.reply_document(
+                f, filename='records.csv.gz', caption=f'{rows} records', read_timeout=120, write_timeout=120)
+    finally:
+        os.remove(filepath)
@@ -1,16 +1,125 @@
+import heapq
 import time
+from typing import Callable, Iterable
 
-from telegram import InlineKeyboardButton, InlineKeyboardMarkup, Update
+from telegram import Bot, InlineKeyboardButton, InlineKeyboardMarkup, Update
 from telegram.error import Forbidden, TimedOut
-from telegram.ext import ContextTypes
+from telegram.ext import ContextTypes, JobQueue
 
-from base.data import localDict
+from base.data import RecordSerializer, localDict
 from base.debug import eprint
 from base.log import logger
 from base.message import delete_message, send_message
-from command.notify import channel_notify
+from command.notify import ChannelIndex, NotifyBatch
 
-records = localDict('records', digit_mode=True)
+
+def open_records(folder: str = 'data', data: dict = None) -> localDict:
+    """
+    Reminder records of a bot, stored in `bot_data['records']`.
+    :param data: records handed off by another process, instead of loading from file
+    """
+    return localDict('records', folder=folder, digit_mode=True, serializer=RecordSerializer(), threaded=True, data=data)
+
+
+def hours_since_hack(rc: dict, now: int) -> int:
+    """
+    Hours since the last hack, or -1 if not hacked yet.
+    `dh` of a record is only refreshed at its deadlines, see `Deadlines.deadline`.
+    """
+    return -1 if rc['dh'] == -1 else (now - rc['ts']) // 3600
+
+
+class Deadlines:
+    """
+    The next hour boundary of each chat at which `remind` has something to do,
+    bucketed by second. Stale entries, left by records updated or deleted
+    since, are dropped when met.
+    """
+
+    def __init__(self, records: localDict, on_push: Callable[[], None] = None) -> None:
+        """
+        :param on_push: called after a chat is pushed, to reschedule the wakeup
+        """
+        self.records = records
+        self.on_push = on_push
+        self.buckets: dict[int, list[int]] = {}
+        self.heap: list[int] = []
+        for chat, rc in records.items():
+            self.buckets.setdefault(self.deadline(rc), []).append(chat)
+        self.heap = list(self.buckets)
+        heapq.heapify(self.heap)
+
+    @staticmethod
+    def deadline(rc: dict) -> int:
+        """
+        When the chat is alerted, its alert deleted, or removed.
+        `dh` is not refreshed at the hours in between.
+        """
+        if rc['dh'] == -1:  # removed if not hacked in 24 hours
+            return rc['ts'] + 24 * 3600
+        hours = rc['dh'] + 1
+        if 'alert' not in rc:
+            hours = max(hours, 24)
+        if 24 < hours < 30 and hours % 2:
+            hours += 1
+        return rc['ts'] + hours * 3600
+
+    def push(self, chat: int, rc: dict, notify=True) -> None:
+        deadline = self.deadline(rc)
+        if deadline not in self.buckets:
+            self.buckets[deadline] = []
+            heapq.heappush(self.heap, deadline)
+        self.buckets[deadline].append(chat)
+        notify and self.on_push is not None and self.on_push()
+
+    def __live(self, deadline: int) -> bool:
+        """
+        Drop stale entries of the bucket, return True if any is left.
+        """
+        bucket = []
+        for chat in self.buckets[deadline]:
+            rc = self.records[chat]
+            if rc is not None and self.deadline(rc) == deadline:
+                bucket.append(chat)
+        self.buckets[deadline] = bucket
+        return len(bucket) > 0
+
+    def next(self) -> int | None:
+        """
+        The earliest deadline, stale ones before it are dropped.
+        """
+        while self.heap:
+            if self.__live(self.heap[0]):
+                return self.heap[0]
+            del self.buckets[heapq.heappop(self.heap)]
+        return None
+
+    def last(self, until: int) -> int | None:
+        """
+        The latest deadline no later than `until`.
+        """
+        latest, stack = None, [0]
+        while stack:  # only subtrees of the heap with deadlines no later than `until`
+            i = stack.pop()
+            if i >= len(self.heap) or self.heap[i] > until:
+                continue
+            if (latest is None or self.heap[i] > latest) and self.__live(self.heap[i]):
+                latest = self.heap[i]
+            stack += [2 * i + 1, 2 * i + 2]
+        return latest
+
+    def pop_due(self, now: int) -> dict[int, int]:
+        """
+        Pop chats due at `now`, return {chat: deadline}.
+        """
+        due = {}
+        while self.heap and self.heap[0] <= now:
+            deadline = heapq.heappop(self.heap)
+            for chat in self.buckets.pop(deadline):
+                rc = self.records[chat]
+                if rc is not None and self.deadline(rc) == deadline:
+                    due[chat] = deadline
+        return due
 
 
 SIGNIN_KEYBOARD = InlineKeyboardMarkup([[
@@ -18,6 +127,7 @@ SIGNIN_KEYBOARD = InlineKeyboardMarkup([[
 
 
 async def start_reminder(update: Update, context: ContextTypes.DEFAULT_TYPE) -> None:
+    records: localDict = context.bot_data['records']
     chat = update.effective_chat.id
     if chat in records:
         await update.effective_message.reply_text('You have already started.')
@@ -31,10 +141,12 @@ async def start_reminder(update: Update, context: ContextTypes.DEFAULT_TYPE) ->
         "After you have hacked any Ingress portal, click the button below to refresh your record."
     await update.effective_message.reply_text(text, reply_markup=SIGNIN_KEYBOARD, parse_mode='Markdown')
     records.set(chat, rc)
+    context.bot_data['deadlines'].push(chat, rc)
     logger.info(f'START {chat}:{update.effective_chat.effective_name}')
 
 
 async def cancel_reminder(update: Update, context: ContextTypes.DEFAULT_TYPE) -> None:
+    records: localDict = context.bot_data['records']
     chat = update.effective_chat.id
     records.delete(chat)
     await update.effective_message.reply_text('You have canceled the reminder. If you want to use it again, please /start.')
@@ -42,6 +154,7 @@ async def cancel_reminder(update: Update, context: ContextTypes.DEFAULT_TYPE) ->
 
 
 async def already_hacked(update: Update, context: ContextTypes.DEFAULT_TYPE) -> None:
+    records: localDict = context.bot_data['records']
     chat = update.effective_chat.id
     if chat not in records:
         await update.effective_message.reply_text('Please /start first.')
@@ -55,13 +168,108 @@ async def already_hacked(update: Update, context: ContextTypes.DEFAULT_TYPE) ->
         await delete_message(context.bot, chat, rc['alert'])
     rc = {'ts': int(time.time() - 1800), 'dh': 0}
     records.set(chat, rc)
+    context.bot_data['deadlines'].push(chat, rc)
     logger.info(f'HACK {chat}:{update.effective_chat.effective_name}')
 
 
-async def reminder(context: ContextTypes.DEFAULT_TYPE) -> None:
+class ReminderScheduler:
+    """
+    Run `remind` for the chats of every bot at their deadlines,
+    instead of scanning all records at a fixed interval.
+    The wakeup is planned again whenever a deadline is pushed, earlier for
+    a new earlier deadline, or later if the planned one became stale.
+    """
+    # a wakeup is delayed to cover the deadlines due within this many seconds
+    # after the earliest one, so there is at most one wakeup per COALESCE seconds
+    COALESCE = 60
+    MIN_INTERVAL = 1  # seconds between wakeups, against busy loops if ticks keep failing
+    MAX_INTERVAL = 3600  # wake up at least once an hour, in case of clock changes
+
+    def __init__(self, job_queue: JobQueue, apps: list, job_kwargs: dict = None) -> None:
+        self.job_queue = job_queue
+        self.apps = apps
+        self.job_kwargs = job_kwargs
+        self.job = None
+        self.when = None
+        self.stopping = False
+        self.last = 0.0
+        self.wakeups = 0
+        self.lateness = 0.0  # max seconds from a deadline to its wakeup, shown in /stats
+
+    def schedule(self, when: float) -> None:
+        """
+        Wake up at `when`, instead of the planned wakeup.
+        """
+        if self.stopping:
+            return
+        when = max(when, self.last + self.MIN_INTERVAL)
+        if self.job is not None:
+            if self.when == when:
+                return
+            self.job.schedule_removal()
+        self.when = when
+        self.job = self.job_queue.run_once(self.tick, max(0, when - time.time()), job_kwargs=self.job_kwargs)
+
+    async def tick(self, context: ContextTypes.DEFAULT_TYPE) -> None:
+        self.job = None
+        self.last = time.time()
+        self.wakeups += 1
+        now = int(self.last)
+        try:
+            for app in self.apps:
+                records: localDict = app.bot_data['records']
+                deadlines: Deadlines = app.bot_data['deadlines']
+                due = deadlines.pop_due(now)
+                if len(due) == 0:
+                    continue
+                self.lateness = max(self.lateness, self.last - min(due.values()))
+                try:
+                    await remind(app.bot, records, app.bot_data['channels'], due, lambda: self.stopping)
+                finally:  # chats not refreshed are due again at the next wakeup
+                    for chat in due:
+                        if chat in records:
+                            deadlines.push(chat, records[chat], notify=False)
+        finally:
+            self.plan()
+
+    def stop(self) -> None:
+        """
+        Stop waking up, and stop a running tick after the chat it is at.
+        Chats left are reminded by the new process, or after the next start.
+        """
+        self.stopping = True
+        if self.job is not None:
+            self.job.schedule_removal()
+            self.job = None
+
+    def plan(self) -> None:
+        """
+        Wake up at the earliest deadline of all bots, delayed to cover those
+        due within COALESCE seconds after it.
+        """
+        deadlines: list[Deadlines] = [app.bot_data['deadlines'] for app in self.apps]
+        first = min((x for x in (d.next() for d in deadlines) if x is not None), default=None)
+        when = time.time() + self.MAX_INTERVAL
+        if first is not None:
+            when = min(when, max(x for x in (d.last(first + self.COALESCE) for d in deadlines) if x is not None))
+        self.schedule(when)
+
+
+async def remind(bot: Bot, records: localDict, channels: ChannelIndex, chats: Iterable[int] = None,
+                 stopping: Callable[[], bool] = None) -> None:
+    """
+    Refresh records of `chats`, all chats by default: send alerts, and remove lost streaks.
+    Stop early once `stopping` returns True, keeping what is done so far.
+    """
     removed_chat = []
-    for chat in records:
+    batch = NotifyBatch(channels)
+    for chat in list(records) if chats is None else chats:
+        if stopping is not None and stopping():
+            break
         rc = records[chat]
+        if rc is None:  # canceled, maybe while awaiting a previous chat
+            continue
+        rc = dict(rc)  # records are dumped by snapshot, never update in place
         delta_hours = (int(time.time()) - rc['ts']) // 60 // 60
         if delta_hours == rc['dh']:
             continue
@@ -72,15 +280,15 @@ async def reminder(context: ContextTypes.DEFAULT_TYPE) -> None:
         rc['dh'] = delta_hours
         if delta_hours < 24:
             if 'alert' in rc:
-                await delete_message(context.bot, chat, rc['alert'])
+                await delete_message(bot, chat, rc['alert'])
                 del rc['alert']
-            records.set(chat, rc)
+            records.set(chat, rc, update=False)
         elif delta_hours >= 36:
             if 'alert' in rc:
-                await delete_message(context.bot, chat, rc['alert'])
+                await delete_message(bot, chat, rc['alert'])
                 del rc["alert"]
             text = "Sorry, you lost your Sojourner Streak. Please /start to try again."
-            await send_message(context.bot, chat, text)
+            await send_message(bot, chat, text)
             removed_chat.append(chat)
             logger.info(f'REMOVE {chat}')
         elif delta_hours >= 30 or delta_hours % 2 == 0:
@@ -95,21 +303,25 @@ async def reminder(context: ContextTypes.DEFAULT_TYPE) -> None:
                 raw_text = (f'!!!!!!!! YOU HAVE NOT HACKED ANY PORTALS IN INGRESS FOR {delta_hours} HOURS, '
                             'PLEASE HACK IMMEDIATELY !!!!!!!!')
             try:
-                msg = await context.bot.send_message(chat, text, reply_markup=SIGNIN_KEYBOARD, parse_mode='Markdown')
+                msg = await bot.send_message(chat, text, reply_markup=SIGNIN_KEYBOARD, parse_mode='Markdown')
                 if 'alert' in rc:
-                    await delete_message(context.bot, chat, rc['alert'])
-                await channel_notify(chat, 'Ingress Sojourner Reminder', raw_text)
+                    await delete_message(bot, chat, rc['alert'])
+                batch.add(chat, 'Ingress Sojourner Reminder', raw_text)
                 rc['alert'] = msg.message_id
-                records.set(chat, rc)
+                records.set(chat, rc, update=False)
                 logger.info(f'ALERT {chat}:{delta_hours}')
             except Forbidden as e:
                 eprint(e, msg=f'Error when sending message to {chat}')
                 removed_chat.append(chat)
             except TimedOut as e:
                 logger.debug(f'Timeout when sending message to {chat}')
+                records[chat] = rc
             except Exception as e:
                 eprint(e, msg=f'Error when sending message to {chat}')
+                records[chat] = rc
         else:
-            records.set(chat, rc)
+            records.set(chat, rc, update=False)
     for chat in removed_chat:
-        records.delete(chat)
+        records.delete(chat, update=False)
+    records.dump()  # once per tick
+    await batch.flush()
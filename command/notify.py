@@ -1,12 +1,63 @@
+from collections import defaultdict
+
 from apprise import Apprise
 from telegram import Update
 from telegram.ext import ContextTypes
 
-from base.data import localDict
+from base.data import localJournalDict
 from base.debug import eprint
 from base.log import logger
 
-channels = localDict('channels', digit_mode=True)
+
+class ChannelIndex:
+    """
+    Notification channels of chats, with a reverse index from channel URL to chats.
+    """
+
+    def __init__(self, folder: str = 'data', data: dict = None) -> None:
+        self.store = localJournalDict('channels', folder=folder, digit_mode=True, threaded=True, data=data)
+        self.index: dict[str, set[int]] = defaultdict(set)
+        for chat_id, urls in self.store.items():
+            for url in urls:
+                self.index[url].add(chat_id)
+
+    def __contains__(self, chat_id: int) -> bool:
+        return chat_id in self.store
+
+    def __getitem__(self, chat_id: int) -> list[str]:
+        return self.store[chat_id] or []
+
+    def has(self, chat_id: int, url: str) -> bool:
+        return chat_id in self.index.get(url, ())
+
+    def chats(self, url: str) -> set[int]:
+        """
+        Chats which added the channel.
+        """
+        return self.index.get(url, set())
+
+    def add(self, chat_id: int, url: str) -> None:
+        self.store.set(chat_id, self[chat_id] + [url])
+        self.index[url].add(chat_id)
+
+    def remove(self, chat_id: int, url: str) -> None:
+        urls = [x for x in self[chat_id] if x != url]
+        if len(urls) == 0:
+            self.store.delete(chat_id)
+        else:
+            self.store.set(chat_id, urls)
+        self.index[url].discard(chat_id)
+        if len(self.index[url]) == 0:
+            del self.index[url]
+
+
+def open_channels(folder: str = 'data', data: dict = None) -> ChannelIndex:
+    """
+    Notification channels of a bot, stored in `bot_data['channels']`.
+    :param data: channels handed off by another process, instead of loading from file
+    """
+    return ChannelIndex(folder, data)
+
 
 SUPPORT_CHANNELS = {
     'Bark': {'protocols': ['bark', 'barks'], 'url': 'https://github.com/caronc/apprise/wiki/Notify_bark', },
@@ -22,8 +73,12 @@ for channel in SUPPORT_CHANNELS:
     HELP_TEXT += f'- [{channel}]({SUPPORT_CHANNELS[channel]["url"]})\n'
     SUPPORT_PROTOCOLS += SUPPORT_CHANNELS[channel]['protocols']
 
+# group bots and topics, where several messages can be delivered as one
+BATCH_PROTOCOLS = ['feishu', 'ntfy', 'wecombot']
+
 
 async def channel_list(update: Update, context: ContextTypes.DEFAULT_TYPE) -> None:
+    channels: ChannelIndex = context.bot_data['channels']
     chat_id = update.effective_chat.id
     if chat_id not in channels:
         await update.effective_message.reply_text('No notification channel added.')
@@ -35,6 +90,7 @@ async def channel_list(update: Update, context: ContextTypes.DEFAULT_TYPE) -> No
 
 
 async def channel_add(update: Update, context: ContextTypes.DEFAULT_TYPE) -> None:
+    channels: ChannelIndex = context.bot_data['channels']
     chat_id = update.effective_chat.id
     # every chat can only have three channels at most
     if chat_id in channels and len(channels[chat_id]) >= 3:
@@ -69,14 +125,15 @@ async def channel_add(update: Update, context: ContextTypes.DEFAULT_TYPE) -> Non
             parse_mode='Markdown'
         )
         return
-    if chat_id not in channels:
-        channels[chat_id] = []
-    channels[chat_id].append(arg)
-    channels.dump()
+    if channels.has(chat_id, arg):
+        await update.effective_message.reply_text('Notification channel already added.')
+        return
+    channels.add(chat_id, arg)
     await update.effective_message.reply_text('Notification channel added.')
 
 
 async def channel_del(update: Update, context: ContextTypes.DEFAULT_TYPE) -> None:
+    channels: ChannelIndex = context.bot_data['channels']
     chat_id = update.effective_chat.id
     if chat_id not in channels or len(channels[chat_id]) == 0:
         await update.effective_message.reply_text('No notification channel added.')
@@ -91,22 +148,54 @@ async def channel_del(update: Update, context: ContextTypes.DEFAULT_TYPE) -> Non
             list_text += f'{channel}\n'
         await update.effective_message.reply_text('Please provide a URL.\n\n' + list_text)
         return
-    if arg not in channels[chat_id]:
+    if not channels.has(chat_id, arg):
         await update.effective_message.reply_text('Channel not found.')
         return
-    channels[chat_id].remove(arg)
-    if len(channels[chat_id]) == 0:
-        del channels[chat_id]
-    channels.dump()
+    channels.remove(chat_id, arg)
     await update.effective_message.reply_text('Notification channel deleted.')
 
 
-async def channel_notify(chat_id: int, title: str, body: str) -> None:
-    if chat_id not in channels:
-        return
-    try:
-        ret = Apprise(servers=channels[chat_id]).notify(title=title, body=body)
-        logger.debug(f'channel_notify: {ret}')
-    except Exception as e:
-        eprint(e)
-        return
+class NotifyBatch:
+    """
+    Notifications collected during a reminder tick, one per alerted chat.
+    Each channel gets one delivery per chat which added it, or a single
+    delivery with the messages of all those chats joined if the protocol
+    is in BATCH_PROTOCOLS.
+    """
+
+    def __init__(self, channels: ChannelIndex) -> None:
+        self.channels = channels
+        self.messages: dict[int, tuple[str, str]] = {}  # chat -> (title, body)
+
+    def add(self, chat_id: int, title: str, body: str) -> None:
+        if chat_id in self.channels:
+            self.messages[chat_id] = (title, body)
+
+    def plan(self) -> list[tuple[str, str, str]]:
+        """
+        Deliveries to make, as (url, title, body).
+        """
+        deliveries = []
+        urls = {url for chat_id in self.messages for url in self.channels[chat_id]}
+        for url in urls:
+            entries = [self.messages[x] for x in self.channels.chats(url) if x in self.messages]
+            if url.split('://')[0] in BATCH_PROTOCOLS and len(entries) > 1:
+                deliveries.append((url, entries[0][0], '\n\n'.join(body for _, body in entries)))
+            else:
+                deliveries.extend((url, title, body) for title, body in entries)
+        return deliveries
+
+    async def flush(self) -> None:
+        """
+        Deliver the collected notifications, channels with the same message in one Apprise call.
+        """
+        urls = defaultdict(list)
+        for url, title, body in self.plan():
+            urls[(title, body)].append(url)
+        self.messages.clear()
+        for (title, body), servers in urls.items():
+            try:
+                ret = await Apprise(servers=servers).async_notify(title=title, body=body)
+                logger.debug(f'channel_notify: {len(servers)} channels, {ret}')
+            except Exception as e:
+                eprint(e)
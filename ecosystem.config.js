@@ -1,9 +1,21 @@
+// Start: pm2 start ecosystem.config.js, which starts the first entry only.
+// Hot restart: start the stopped one of the two entries, e.g.
+//   pm2 start ecosystem.config.js --only IngressSojourner-next
+// It takes over from the running one, which exits with code 10 and stays
+// stopped, so the next hot restart starts `IngressSojourner` again.
+// `pm2 restart` stops first and then starts, a cold restart.
+const app = {
+    cmd: 'bot.py',
+    interpreter: '/home/ubuntu/.miniconda3/envs/telegram/bin/python3',
+    autorestart: true,
+    kill_timeout: 30000,  // drain and flush on SIGINT
+    stop_exit_codes: [10],  // exited after handing off to a new process
+    // watch: true,
+};
+
 module.exports = {
-    apps: [{
-        name: 'IngressSojourner',
-        cmd: 'bot.py',
-        interpreter: '/home/ubuntu/.miniconda3/envs/telegram/bin/python3',
-        autorestart: true,
-        // watch: true,
-    }]
+    apps: [
+        { ...app, name: 'IngressSojourner' },
+        { ...app, name: 'IngressSojourner-next', autostart: false },  // for hot restart only
+    ]
 };